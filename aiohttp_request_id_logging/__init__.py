@@ -32,20 +32,34 @@ Usage:
 
 __version__ = "1.0.0"
 
-try:
-    import sentry_sdk
-except ImportError:
-    sentry_sdk = None  # ty: ignore[invalid-assignment]
+from typing import Any
 
-from .context import request_id, REQUEST_ID_KEY, FALLBACK_REQUEST_ID_KEY
+from .context import request_id, request_log_level, REQUEST_ID_KEY, FALLBACK_REQUEST_ID_KEY
 from .errors import RequestIdKeyAlreadySetError
+from .exclusions import PathExclusions
+from .incoming_request_id import IncomingRequestIdHeader
+from .metrics import CancelledRequestStats
 from .middleware import RequestIdMiddleware, request_id_middleware, noop
+from .profiling import RequestProfiler
+from .sentry import add_request_id_to_sentry_event, add_request_id_to_sentry_breadcrumb, set_sentry_scope_enabled
 from .request_id_factories import (
     random_request_id_factory,
     sequential_request_id_factory,
     SequentialRequestIdFactory,
+    snowflake_request_id_factory,
+    SnowflakeRequestIdFactory,
+    ulid_request_id_factory,
+    UlidRequestIdFactory,
 )
-from .logging_setup import setup_logging_request_id_prefix, RequestIdAccessLogger
+from .tasks import (
+    child_request_id,
+    with_child_request_id,
+    create_child_task,
+    install_request_id_task_factory,
+    get_task_request_id,
+)
+from .websocket import WebSocketMessageTracker
+from .logging_setup import setup_logging_request_id_prefix, setup_request_log_level, RequestIdAccessLogger
 
 
 # old names for backward compatibility
@@ -53,19 +67,53 @@ generate_request_id = random_request_id_factory
 RequestIdContextAccessLogger = RequestIdAccessLogger
 
 
+def __getattr__(name: str) -> Any:
+    # sentry_sdk takes long to import, so it is imported only when first
+    # needed (RequestIdMiddleware construction), not with this package.
+    # The result is stored as a plain module attribute - later reads do not
+    # get here, and it can be replaced (monkeypatched in tests) as before.
+    if name == "sentry_sdk":
+        try:
+            import sentry_sdk
+        except ImportError:
+            sentry_sdk = None
+        globals()["sentry_sdk"] = sentry_sdk
+        return sentry_sdk
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 __all__ = [
     "RequestIdMiddleware",
     "request_id_middleware",
     "RequestIdKeyAlreadySetError",
+    "IncomingRequestIdHeader",
+    "PathExclusions",
     "setup_logging_request_id_prefix",
+    "setup_request_log_level",
     "RequestIdAccessLogger",
     "RequestIdContextAccessLogger",
     "random_request_id_factory",
     "generate_request_id",
     "sequential_request_id_factory",
     "SequentialRequestIdFactory",
+    "snowflake_request_id_factory",
+    "SnowflakeRequestIdFactory",
+    "ulid_request_id_factory",
+    "UlidRequestIdFactory",
     "request_id",
+    "request_log_level",
     "REQUEST_ID_KEY",
     "FALLBACK_REQUEST_ID_KEY",
     "noop",
+    "child_request_id",
+    "with_child_request_id",
+    "create_child_task",
+    "install_request_id_task_factory",
+    "get_task_request_id",
+    "CancelledRequestStats",
+    "RequestProfiler",
+    "add_request_id_to_sentry_event",
+    "add_request_id_to_sentry_breadcrumb",
+    "set_sentry_scope_enabled",
+    "WebSocketMessageTracker",
 ]
@@ -0,0 +1,110 @@
+"""
+Measuring the resources used by the steps of a request handler.
+
+A coroutine runs in steps - from being resumed by the event loop until it
+suspends again on an await. Wrapping the handler coroutine with
+run_with_step_hook lets us run code right before and after each step,
+so time spent waiting (for I/O, other requests) can be told apart from time
+spent computing.
+"""
+
+from collections.abc import Awaitable, Callable, Generator
+from sys import getallocatedblocks
+from time import thread_time_ns
+import tracemalloc
+from typing import Any, Protocol, TypeVar
+
+
+T = TypeVar("T")
+
+
+class StepHook(Protocol):
+    def step_started(self) -> None: ...
+
+    def step_finished(self) -> None: ...
+
+
+def _traced_memory() -> int:
+    return tracemalloc.get_traced_memory()[0]
+
+
+# allocation_accounting option value: (probe, unit)
+ALLOCATION_PROBES: dict[str, tuple[Callable[[], int], str]] = {
+    "blocks": (getallocatedblocks, "blocks"),
+    "tracemalloc": (_traced_memory, "bytes"),
+}
+
+
+class RequestUsage:
+    """
+    Thread CPU time spent in the steps of one request handler, and optionally
+    the net allocated memory during those steps - measured as the difference
+    of allocation_probe() values (e.g. sys.getallocatedblocks) before and
+    after each step.
+    """
+
+    __slots__ = ("cpu_time_ns", "allocated", "allocation_probe", "_step_start", "_step_allocated_start")
+
+    def __init__(self, allocation_probe: Callable[[], int] | None = None):
+        self.cpu_time_ns = 0
+        self.allocated = 0
+        self.allocation_probe = allocation_probe
+        self._step_start = 0
+        self._step_allocated_start = 0
+
+    def step_started(self) -> None:
+        if self.allocation_probe is not None:
+            self._step_allocated_start = self.allocation_probe()
+        self._step_start = thread_time_ns()
+
+    def step_finished(self) -> None:
+        self.cpu_time_ns += thread_time_ns() - self._step_start
+        if self.allocation_probe is not None:
+            self.allocated += self.allocation_probe() - self._step_allocated_start
+
+    @property
+    def cpu_time(self) -> float:
+        return self.cpu_time_ns / 1e9
+
+
+async def run_with_step_hook(awaitable: Awaitable[T], hook: StepHook) -> T:
+    """
+    Await the awaitable, calling hook.step_started() and hook.step_finished()
+    around every step of it.
+    """
+    return await _StepHooked(awaitable, hook)
+
+
+class _StepHooked:
+    __slots__ = ("_awaitable", "_hook")
+
+    def __init__(self, awaitable: Awaitable[Any], hook: StepHook):
+        self._awaitable = awaitable
+        self._hook = hook
+
+    def __await__(self) -> Generator[Any, Any, Any]:
+        iterator = self._awaitable.__await__()
+        hook = self._hook
+        send_value = None
+        exception: BaseException | None = None
+        while True:
+            hook.step_started()
+            try:
+                if exception is None:
+                    yielded = iterator.send(send_value)
+                else:
+                    yielded = iterator.throw(exception)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                hook.step_finished()
+            try:
+                send_value = yield yielded
+                exception = None
+            except GeneratorExit:
+                iterator.close()
+                raise
+            except BaseException as e:
+                # for example CancelledError from task.cancel()
+                send_value = None
+                exception = e
@@ -2,6 +2,7 @@
 Constants and context variables shared across the package.
 """
 
+from collections.abc import Callable, Iterator
 from contextvars import ContextVar
 from aiohttp import web
 
@@ -10,15 +11,37 @@ from aiohttp import web
 # or None outside of a request
 request_id: ContextVar[str | None] = ContextVar("request_id", default=None)
 
+# ContextVar that contains (request id, counter of its child ids) - set
+# together with request_id by RequestIdMiddleware and with_child_request_id,
+# so that all the tasks created from the request (their contexts are copies)
+# share one counter and child_request_id() never returns the same id twice
+child_request_id_counter: ContextVar[tuple[str, Iterator[int]] | None] = ContextVar("child_request_id_counter", default=None)
+
+# ContextVar that contains the function logging the deferred request start
+# message (RequestIdMiddleware(request_start_delay=...)) until it is logged;
+# the log record factory calls it before any other log record of the request
+pending_request_start: ContextVar[Callable[[], None] | None] = ContextVar("pending_request_start", default=None)
+
+# ContextVar that contains the log level of the current request
+# (RequestIdMiddleware(get_request_log_level=...)), or None for the logger
+# levels only; read by the loggers after setup_request_log_level()
+request_log_level: ContextVar[int | None] = ContextVar("request_log_level", default=None)
+
 REQUEST_ID_KEY: "web.RequestKey[str] | str"
 FALLBACK_REQUEST_ID_KEY: str | None
+FOLDED_REQUEST_START_KEY: "web.RequestKey[str] | str"
 
 try:
     # key for storing the request id in the request; aiohttp recommends
     # web.RequestKey instances instead of plain strings
     REQUEST_ID_KEY = web.RequestKey("request_id", str)
     FALLBACK_REQUEST_ID_KEY = "request_id"
+    # key for the request start message details (the handler name) to be
+    # folded into the access log line, when the deferred request start
+    # message was not logged
+    FOLDED_REQUEST_START_KEY = web.RequestKey("aiohttp_request_id_logging.folded_request_start", str)
 except AttributeError:
     # older aiohttp without web.RequestKey
     REQUEST_ID_KEY = "request_id"
     FALLBACK_REQUEST_ID_KEY = None
+    FOLDED_REQUEST_START_KEY = "aiohttp_request_id_logging.folded_request_start"
@@ -4,6 +4,8 @@ class RequestIdKeyAlreadySetError(Exception):
 
     This most likely means that request_id_middleware is applied twice,
     or that something else also sets the request id in the request.
+    Not raised by RequestIdMiddleware(reentrant=True) - it passes such
+    a request straight to the handler.
     """
 
     def __init__(self, existing_request_id: str):
@@ -0,0 +1,63 @@
+"""
+Request paths excluded from the request id processing and access logging.
+"""
+
+from collections.abc import Iterable
+from typing import Any
+
+
+# trie node key marking the end of a prefix (no path character is an empty string)
+_END = ""
+
+
+class PathExclusions:
+    """
+    Set of request paths for which RequestIdMiddleware(excluded_paths=...)
+    does nothing at all - no request id, no log message, no Sentry scope,
+    no response header - and whose RequestIdAccessLogger lines are skipped.
+    Meant for health checks and metrics scrapes:
+
+        PathExclusions(paths=["/healthz", "/metrics"], prefixes=["/probe/"])
+
+    - paths: exact request paths
+    - prefixes: path prefixes - every path starting with one of them
+      is excluded
+
+    The exact paths are looked up in a set, the prefixes in a character
+    trie, so a lookup costs one set lookup plus at most as many dict
+    lookups as the longest matching prefix has characters - not one
+    str.startswith() per prefix.
+    """
+
+    __slots__ = ("_paths", "_trie")
+
+    def __init__(self, paths: Iterable[str] = (), prefixes: Iterable[str] = ()):
+        if isinstance(paths, str) or isinstance(prefixes, str):
+            raise TypeError("paths and prefixes must be iterables of str, not a str")
+        self._paths = frozenset(paths)
+        self._trie: dict[str, Any] = {}
+        for prefix in prefixes:
+            node = self._trie
+            for c in prefix:
+                node = node.setdefault(c, {})
+            node[_END] = True
+
+    def __contains__(self, path: str) -> bool:
+        if path in self._paths:
+            return True
+        node = self._trie
+        if not node:
+            return False
+        if _END in node:
+            # the empty prefix
+            return True
+        for c in path:
+            node = node.get(c)
+            if node is None:
+                return False
+            if _END in node:
+                return True
+        return False
+
+    def __bool__(self) -> bool:
+        return bool(self._paths or self._trie)
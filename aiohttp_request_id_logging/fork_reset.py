@@ -0,0 +1,38 @@
+"""
+Resetting per-process state in a forked child process.
+
+Objects holding state that must not be shared between the parent and
+a forked child (request id sequences, background threads, counters...)
+register themselves with register_fork_reset(); their
+_after_fork_in_child() method is called in the child right after fork,
+so the hot paths do not need to check os.getpid().
+"""
+
+import os
+from typing import Protocol
+from weakref import WeakSet
+
+
+class ForkResettable(Protocol):
+    def _after_fork_in_child(self) -> None: ...
+
+
+_registered: "WeakSet[ForkResettable]" = WeakSet()
+
+
+def register_fork_reset(obj: ForkResettable) -> None:
+    """
+    Call obj._after_fork_in_child() in every forked child process,
+    for as long as obj exists.
+    """
+    _registered.add(obj)
+
+
+def _reset_all_in_child() -> None:
+    for obj in list(_registered):
+        obj._after_fork_in_child()
+
+
+# not available on Windows, where there is no fork
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_all_in_child)
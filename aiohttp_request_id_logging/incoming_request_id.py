@@ -0,0 +1,91 @@
+from aiohttp import web
+from collections.abc import Iterable
+from ipaddress import ip_address, ip_network
+import re
+
+
+DEFAULT_ALLOWED_CHARS = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_."
+
+
+class TrustedNetworks:
+    """
+    Set of IP networks (CIDR notation) with a fast membership test
+    for a single address.
+
+    The networks are indexed by IP version and prefix length - an address
+    is checked with one set lookup per distinct prefix length, no matter
+    how many networks there are.
+    """
+
+    def __init__(self, networks: Iterable[str]):
+        index: dict[int, dict[int, set[int]]] = {4: {}, 6: {}}
+        for network in networks:
+            net = ip_network(network, strict=False)
+            shift = net.max_prefixlen - net.prefixlen
+            index[net.version].setdefault(shift, set()).add(int(net.network_address) >> shift)
+        # the longest prefixes (smallest shifts) first
+        self._index = {version: sorted(by_shift.items()) for version, by_shift in index.items()}
+
+    def __contains__(self, address: object) -> bool:
+        if not isinstance(address, str):
+            return False
+        try:
+            ip = ip_address(address)
+        except ValueError:
+            # for example a UNIX socket path in request.remote
+            return False
+        if ip.version == 6 and ip.ipv4_mapped is not None:
+            ip = ip.ipv4_mapped
+        value = int(ip)
+        for shift, network_values in self._index[ip.version]:
+            if value >> shift in network_values:
+                return True
+        return False
+
+
+class IncomingRequestIdHeader:
+    """
+    Ready-made get_request_id implementation adopting the request id
+    from an incoming request header, for example one set by a reverse proxy
+    or by an upstream service.
+
+    Usage: RequestIdMiddleware(get_request_id=IncomingRequestIdHeader(trusted_proxies=["10.0.0.0/8"]))
+
+    The header value is adopted only when:
+
+    - it is not longer than max_length and consists only of allowed_chars
+      (ASCII letters, digits, "-", "_" and "." by default),
+    - the request comes from one of the trusted_proxies networks
+      (checked against request.remote); trusted_proxies=None (the default)
+      skips this check - use it only when every request passes through
+      a proxy that sets or strips the header.
+
+    Otherwise None is returned and the middleware generates a new request id.
+    """
+
+    def __init__(
+        self,
+        header_name: str = "X-Request-Id",
+        *,
+        max_length: int = 64,
+        allowed_chars: str = DEFAULT_ALLOWED_CHARS,
+        trusted_proxies: Iterable[str] | None = None,
+    ):
+        if not isinstance(header_name, str):
+            raise TypeError("header_name must be a str")
+        if not isinstance(max_length, int) or max_length < 1:
+            raise ValueError("max_length must be a positive int")
+        if not allowed_chars:
+            raise ValueError("allowed_chars must not be empty")
+        self.header_name = header_name
+        self.max_length = max_length
+        self._fullmatch = re.compile(f"[{re.escape(allowed_chars)}]{{1,{max_length}}}").fullmatch
+        self.trusted_proxies = None if trusted_proxies is None else TrustedNetworks(trusted_proxies)
+
+    def __call__(self, request: web.Request) -> str | None:
+        value = request.headers.get(self.header_name)
+        if not value or len(value) > self.max_length or not self._fullmatch(value):
+            return None
+        if self.trusted_proxies is not None and request.remote not in self.trusted_proxies:
+            return None
+        return value
@@ -0,0 +1,231 @@
+"""
+Regrouping interleaved log lines of concurrent requests - the lines
+of every request are output together, when the request finishes.
+
+Command line usage:
+
+    tail -F /var/log/app.log | python -m aiohttp_request_id_logging.log_demux
+    python -m aiohttp_request_id_logging.log_demux /var/log/app.log.1 /var/log/app.log
+
+The lines are grouped by the request id found in the "%(requestIdPrefix)s"
+prefix ("[req:kbyLG8d] ", see setup_logging_request_id_prefix) or in
+a "request_id" field of JSON formatted lines.
+"""
+
+from argparse import ArgumentParser
+from collections import OrderedDict
+from collections.abc import Iterable, Iterator
+import fileinput
+from queue import Empty, Queue
+import sys
+from threading import Thread
+from time import monotonic
+
+from .log_parsing import ACCESS_LOG_LINE_PATTERN, DEFAULT_PREFIX_FORMAT, ContinuationLineTracker, get_line_request_id, request_id_line_pattern
+
+
+# (request id, lines) - request id is None for a line without a request id
+LineGroup = tuple[str | None, list[str]]
+
+
+class _Group:
+    __slots__ = ("lines", "last_seen")
+
+    def __init__(self, last_seen: float):
+        self.lines: list[str] = []
+        self.last_seen = last_seen
+
+
+class LogDemultiplexer:
+    """
+    Collects log lines per request id and releases the lines of a request
+    as one group when its access log line arrives ('"GET / HTTP/1.1" 200',
+    see RequestIdAccessLogger), or when no line of the request has arrived
+    for timeout seconds (the request has no access log line, or it was
+    missed).
+
+    Lines without a request id are released right away, except continuation
+    lines of a multi-line log record - a traceback logged by logger.exception(),
+    or any indented or empty line - which belong to the group of the line
+    before them.
+
+    Lines with a child request id ("abc1234.1", see with_child_request_id)
+    belong to the group of the parent request, if it is being collected,
+    unless group_children is False. Request ids containing "." that are not
+    child ids (adopted from a client, see IncomingRequestIdHeader) get their
+    own group - their parent id is not being collected.
+
+    Memory is bounded: at most max_requests requests are collected at once
+    (the least recently active one is released early when a new one comes),
+    and a request with more than max_lines_per_request lines is released
+    in parts.
+    """
+
+    def __init__(
+        self,
+        *,
+        prefix_format: str = DEFAULT_PREFIX_FORMAT,
+        timeout: float = 60.0,
+        max_requests: int = 10000,
+        max_lines_per_request: int = 1000,
+        group_children: bool = True,
+    ):
+        if timeout <= 0:
+            raise ValueError("timeout must be positive")
+        if max_requests < 1 or max_lines_per_request < 1:
+            raise ValueError("max_requests and max_lines_per_request must be at least 1")
+        self.pattern = request_id_line_pattern(prefix_format)
+        self.timeout = timeout
+        self.max_requests = max_requests
+        self.max_lines_per_request = max_lines_per_request
+        self.group_children = group_children
+        # least recently active first
+        self._groups: OrderedDict[str, _Group] = OrderedDict()
+        # group key of the previous log record, for its continuation lines
+        self._last_key: str | None = None
+        self._continuation = ContinuationLineTracker()
+
+    def feed(self, line: str, now: float | None = None) -> list[LineGroup]:
+        """
+        Add a line; return the groups released by it (and by the timeout).
+        """
+        if now is None:
+            now = monotonic()
+        released = self.expire(now)
+        req_id = get_line_request_id(self.pattern, line)
+        if req_id is None:
+            last_key = self._last_key if self._continuation.is_continuation(line) else None
+            if last_key is None or last_key not in self._groups:
+                self._last_key = None
+                released.append((None, [line]))
+                return released
+            key = last_key
+        else:
+            self._continuation.reset()
+            key = self._last_key = self._group_key(req_id)
+        group = self._groups.get(key)
+        if group is None:
+            if len(self._groups) >= self.max_requests:
+                oldest_key, oldest = self._groups.popitem(last=False)
+                released.append((oldest_key, oldest.lines))
+            group = self._groups[key] = _Group(now)
+        else:
+            self._groups.move_to_end(key)
+            group.last_seen = now
+        group.lines.append(line)
+        if req_id == key and ACCESS_LOG_LINE_PATTERN.search(line):
+            del self._groups[key]
+            released.append((key, group.lines))
+        elif len(group.lines) >= self.max_lines_per_request:
+            released.append((key, group.lines))
+            group.lines = []
+        return released
+
+    def _group_key(self, req_id: str) -> str:
+        # the request itself, or the first of its parents ("abc" for
+        # "abc.1.2", then "abc.1") whose group is being collected
+        if not self.group_children or req_id in self._groups:
+            return req_id
+        dot = req_id.find(".")
+        while dot != -1:
+            parent_id = req_id[:dot]
+            if parent_id in self._groups:
+                return parent_id
+            dot = req_id.find(".", dot + 1)
+        return req_id
+
+    def expire(self, now: float | None = None) -> list[LineGroup]:
+        """
+        Release the groups of requests with no line in the last timeout seconds.
+        """
+        if now is None:
+            now = monotonic()
+        released: list[LineGroup] = []
+        deadline = now - self.timeout
+        while self._groups:
+            key, group = next(iter(self._groups.items()))
+            if group.last_seen > deadline:
+                break
+            del self._groups[key]
+            if group.lines:
+                released.append((key, group.lines))
+        return released
+
+    def flush(self) -> list[LineGroup]:
+        """
+        Release all groups collected so far - at the end of the input.
+        """
+        released: list[LineGroup] = [(key, group.lines) for key, group in self._groups.items() if group.lines]
+        self._groups.clear()
+        return released
+
+
+def demux_log_lines(lines: Iterable[str], **kwargs) -> Iterator[LineGroup]:
+    """
+    Yield (request id, lines) groups of the given log lines - see
+    LogDemultiplexer for the keyword arguments.
+
+    The timeout is checked only when a line arrives; at the end of the input
+    all the remaining groups are yielded.
+    """
+    demux = LogDemultiplexer(**kwargs)
+    for line in lines:
+        yield from demux.feed(line)
+    yield from demux.flush()
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = ArgumentParser(prog="aiohttp-request-id-log-demux", description="Regroup interleaved log lines by request id.")
+    parser.add_argument("log_files", nargs="*", help="log files to read (default: standard input)")
+    parser.add_argument(
+        "--prefix-format", default=DEFAULT_PREFIX_FORMAT, help="request id prefix format, as passed to setup_logging_request_id_prefix"
+    )
+    parser.add_argument("--timeout", type=float, default=60.0, help="release the lines of a request after this many seconds of inactivity")
+    parser.add_argument("--max-requests", type=int, default=10000, help="maximum number of requests collected at once")
+    parser.add_argument("--max-lines-per-request", type=int, default=1000, help="release the lines of a request in parts of this size")
+    parser.add_argument("--no-children", action="store_true", help="do not group child request ids (abc1234.1...) with their parent")
+    args = parser.parse_args(argv)
+
+    demux = LogDemultiplexer(
+        prefix_format=args.prefix_format,
+        timeout=args.timeout,
+        max_requests=args.max_requests,
+        max_lines_per_request=args.max_lines_per_request,
+        group_children=not args.no_children,
+    )
+
+    # read the input in a thread, so that the timeout is checked also while
+    # a live stream is quiet
+    lines: Queue[str | None] = Queue(maxsize=1000)
+
+    def read_lines() -> None:
+        try:
+            for line in fileinput.input(args.log_files, errors="replace"):
+                lines.put(line)
+        finally:
+            lines.put(None)
+
+    Thread(target=read_lines, name="LogReader", daemon=True).start()
+
+    out = sys.stdout
+    while True:
+        try:
+            line = lines.get(timeout=min(args.timeout, 1.0))
+        except Empty:
+            released = demux.expire()
+        else:
+            if line is None:
+                break
+            released = demux.feed(line)
+        for _, group_lines in released:
+            out.writelines(group_lines)
+        if released:
+            out.flush()
+    for _, group_lines in demux.flush():
+        out.writelines(group_lines)
+    out.flush()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
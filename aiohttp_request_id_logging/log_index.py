@@ -0,0 +1,273 @@
+"""
+Index of log files by request id - for finding all log lines of a request
+across (rotated) log files without grepping through all of them.
+
+Command line usage:
+
+    python -m aiohttp_request_id_logging.log_index build --index logs.idx /var/log/app.log*
+    python -m aiohttp_request_id_logging.log_index lookup --index logs.idx kbyLG8d
+
+The log lines are recognized by the "%(requestIdPrefix)s" prefix
+("[req:kbyLG8d] ", see setup_logging_request_id_prefix) or by
+a "request_id" field of JSON formatted lines. Continuation lines of
+a multi-line log record (a traceback, indented or empty lines) are
+indexed under the request id of the line before them.
+"""
+
+from argparse import ArgumentParser
+from collections.abc import Iterable, Iterator
+from mmap import ACCESS_READ, mmap
+import os
+from pathlib import Path
+import sqlite3
+import sys
+
+from .log_parsing import DEFAULT_PREFIX_FORMAT, ContinuationLineTracker, request_id_line_bytes_pattern
+
+
+_schema = """
+    CREATE TABLE IF NOT EXISTS files (
+        id INTEGER PRIMARY KEY,
+        path TEXT NOT NULL,
+        device INTEGER NOT NULL,
+        inode INTEGER NOT NULL,
+        indexed_size INTEGER NOT NULL,
+        UNIQUE (device, inode)
+    );
+    CREATE TABLE IF NOT EXISTS lines (
+        request_id TEXT NOT NULL,
+        file_id INTEGER NOT NULL,
+        offset INTEGER NOT NULL,
+        PRIMARY KEY (request_id, file_id, offset)
+    ) WITHOUT ROWID;
+"""
+
+
+class LogIndex:
+    """
+    On-disk (SQLite) index from request id to log file and byte offset
+    of the log lines of that request.
+
+    Files are identified by device and inode, so a rotated file
+    (app.log renamed to app.log.1) keeps its index entries, and only
+    the new content of every file is scanned on update(). Compressed
+    rotated files (app.log.2.gz) are not supported.
+
+    The new lines are indexed in batches of batch_size lines, each committed
+    together with the offset reached, so memory use does not grow with the
+    size of the log files, and an interrupted update() continues where
+    it stopped.
+
+    Continuation lines appended after the last update() are indexed under
+    the request id of the line before them, as long as it is at most
+    max_lookback_lines lines back.
+    """
+
+    batch_size: int = 100_000
+    max_lookback_lines: int = 1000
+
+    def __init__(self, index_path: str | Path, prefix_format: str = DEFAULT_PREFIX_FORMAT):
+        self.pattern = request_id_line_bytes_pattern(prefix_format)
+        self._db = sqlite3.connect(index_path)
+        self._db.executescript(_schema)
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self) -> "LogIndex":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def update(self, paths: Iterable[str | Path]) -> int:
+        """
+        Index the new content of the given log files. Pass all the log files,
+        including the rotated ones - index entries of files that no longer
+        exist under their recorded path are removed.
+
+        Returns the number of newly indexed lines.
+        """
+        seen_file_ids = set()
+        indexed_count = 0
+        for path in paths:
+            path = os.path.abspath(path)
+            st = os.stat(path)
+            with self._db:
+                row = self._db.execute("SELECT id, indexed_size FROM files WHERE device = ? AND inode = ?", (st.st_dev, st.st_ino)).fetchone()
+                if row is None:
+                    cursor = self._db.execute(
+                        "INSERT INTO files (path, device, inode, indexed_size) VALUES (?, ?, ?, 0)", (path, st.st_dev, st.st_ino)
+                    )
+                    file_id, indexed_size = cursor.lastrowid, 0
+                else:
+                    file_id, indexed_size = row
+                    self._db.execute("UPDATE files SET path = ? WHERE id = ?", (path, file_id))
+                    if st.st_size < indexed_size:
+                        # the file was truncated (logrotate copytruncate) - index it again
+                        self._db.execute("DELETE FROM lines WHERE file_id = ?", (file_id,))
+                        indexed_size = 0
+                seen_file_ids.add(file_id)
+            if st.st_size > indexed_size:
+                for indexed_size, entries in self._scan(path, indexed_size):
+                    with self._db:
+                        self._db.executemany(
+                            "INSERT OR IGNORE INTO lines (request_id, file_id, offset) VALUES (?, ?, ?)",
+                            ((req_id, file_id, offset) for req_id, offset in entries),
+                        )
+                        self._db.execute("UPDATE files SET indexed_size = ? WHERE id = ?", (indexed_size, file_id))
+                    indexed_count += len(entries)
+        with self._db:
+            for file_id, path, device, inode in self._db.execute("SELECT id, path, device, inode FROM files").fetchall():
+                if file_id not in seen_file_ids and not _is_same_file(path, device, inode):
+                    self._db.execute("DELETE FROM lines WHERE file_id = ?", (file_id,))
+                    self._db.execute("DELETE FROM files WHERE id = ?", (file_id,))
+        return indexed_count
+
+    def _scan(self, path: str, start: int) -> Iterator[tuple[int, list[tuple[str, int]]]]:
+        """
+        Find the request ids in the complete lines of the file from the start
+        offset on. Yields batches of at most batch_size (request id, line offset)
+        pairs, each together with the offset the batch was scanned up to -
+        the start of a line; the last one is the offset after the last complete
+        line (an incomplete last line is scanned on the next update).
+        """
+        with open(path, "rb") as f, mmap(f.fileno(), 0, access=ACCESS_READ) as mm:
+            end = mm.rfind(b"\n", start) + 1
+            if end <= start:
+                return
+            entries: list[tuple[str, int]] = []
+            for req_id, offset in self._iter_lines(mm, self._find_record_start(mm, start), end):
+                if offset < start:
+                    # indexed by a previous update()
+                    continue
+                if len(entries) >= self.batch_size:
+                    # every line before this one has been scanned
+                    yield offset, entries
+                    entries = []
+                entries.append((req_id, offset))
+            yield end, entries
+
+    def _find_record_start(self, mm: mmap, start: int) -> int:
+        # the lines from start on may be continuation lines of the last log line
+        # with a request id before start - scan again from that line
+        pos = start
+        for _ in range(self.max_lookback_lines):
+            if pos == 0 or self.pattern.match(mm, pos):
+                return pos
+            pos = mm.rfind(b"\n", 0, pos - 1) + 1
+        return start
+
+    def _iter_lines(self, mm: mmap, start: int, end: int) -> Iterator[tuple[str, int]]:
+        # (request id, line offset) of the lines with a request id and of their continuation lines
+        continuation = ContinuationLineTracker()
+        req_id = None
+        pos = start
+        for m in self.pattern.finditer(mm, start, end):
+            if req_id is not None:
+                yield from self._iter_continuation_lines(mm, req_id, pos, m.start(), continuation)
+            continuation.reset()
+            req_id = (m.group("prefix_id") or m.group("json_id")).decode("utf-8", "replace")
+            yield req_id, m.start()
+            pos = mm.find(b"\n", m.start()) + 1
+        if req_id is not None:
+            yield from self._iter_continuation_lines(mm, req_id, pos, end, continuation)
+
+    @staticmethod
+    def _iter_continuation_lines(mm: mmap, req_id: str, pos: int, end: int, continuation: ContinuationLineTracker) -> Iterator[tuple[str, int]]:
+        # the lines from pos up to end have no request id - the leading
+        # continuation lines belong to req_id
+        while pos < end:
+            line_end = mm.find(b"\n", pos, end)
+            if not continuation.is_continuation(mm[pos:line_end]):
+                return
+            yield req_id, pos
+            pos = line_end + 1
+
+    def lookup(self, req_id: str, *, include_children: bool = True) -> Iterator[tuple[str, bytes]]:
+        """
+        Yield (file path, line) of all indexed log lines of the given request,
+        older files (by modification time) first. With include_children, also
+        the lines logged with child request ids ("abc1234.1", see
+        with_child_request_id) are included.
+        """
+        if include_children:
+            # "." + 1 == "/" - the range of all strings starting with req_id + "."
+            rows = self._db.execute(
+                "SELECT file_id, offset FROM lines WHERE request_id = ? OR (request_id >= ? AND request_id < ?)",
+                (req_id, req_id + ".", req_id + "/"),
+            ).fetchall()
+        else:
+            rows = self._db.execute("SELECT file_id, offset FROM lines WHERE request_id = ?", (req_id,)).fetchall()
+        offsets_by_file: dict[int, list[int]] = {}
+        for file_id, offset in rows:
+            offsets_by_file.setdefault(file_id, []).append(offset)
+        files = []
+        for file_id, offsets in offsets_by_file.items():
+            path, device, inode = self._db.execute("SELECT path, device, inode FROM files WHERE id = ?", (file_id,)).fetchone()
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if (st.st_dev, st.st_ino) != (device, inode):
+                # rotated away since the last update()
+                continue
+            files.append((st.st_mtime, path, sorted(offsets)))
+        files.sort()
+        for _, path, offsets in files:
+            with open(path, "rb") as f:
+                try:
+                    mm = mmap(f.fileno(), 0, access=ACCESS_READ)
+                except ValueError:
+                    # an empty file (truncated since the last update()) cannot be mapped
+                    continue
+                with mm:
+                    for offset in offsets:
+                        if offset >= len(mm):
+                            # truncated since the last update()
+                            break
+                        end = mm.find(b"\n", offset)
+                        yield path, mm[offset : end if end != -1 else len(mm)]
+
+
+def _is_same_file(path: str, device: int, inode: int) -> bool:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return False
+    return (st.st_dev, st.st_ino) == (device, inode)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = ArgumentParser(prog="aiohttp-request-id-log-index", description="Find log lines of a request by its request id.")
+    parser.add_argument("--index", "-i", required=True, help="path of the index file (created if it does not exist)")
+    parser.add_argument(
+        "--prefix-format", default=DEFAULT_PREFIX_FORMAT, help="request id prefix format, as passed to setup_logging_request_id_prefix"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="index new content of the log files (pass all of them, including the rotated ones)")
+    build_parser.add_argument("log_files", nargs="+")
+    lookup_parser = subparsers.add_parser("lookup", help="print all log lines of the request")
+    lookup_parser.add_argument("request_id")
+    lookup_parser.add_argument("--no-children", action="store_true", help="do not include lines with child request ids (abc1234.1...)")
+    lookup_parser.add_argument("--with-file-names", "-H", action="store_true", help="prefix every line with its file path")
+    args = parser.parse_args(argv)
+
+    with LogIndex(args.index, prefix_format=args.prefix_format) as index:
+        if args.command == "build":
+            count = index.update(args.log_files)
+            print(f"Indexed {count} new lines", file=sys.stderr)
+            return 0
+        out = sys.stdout.buffer
+        found = False
+        for path, line in index.lookup(args.request_id, include_children=not args.no_children):
+            found = True
+            if args.with_file_names:
+                out.write(os.fsencode(path) + b":")
+            out.write(line + b"\n")
+        out.flush()
+        return 0 if found else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""
+Recognizing request ids in log lines written with the request id prefix
+(see setup_logging_request_id_prefix) or formatted as JSON.
+"""
+
+import re
+
+
+DEFAULT_PREFIX_FORMAT = "[req:{request_id}] "
+
+# aiohttp access log line - '"GET /path HTTP/1.1" 200' - possibly with
+# the quotes escaped inside a JSON formatted line
+ACCESS_LOG_LINE_PATTERN = re.compile(r'\\?"[A-Z]+ \S+ HTTP/[\d.]+\\?" \d{3}\b')
+
+# first lines of a traceback (or of a stack dump, logged with stack_info=True)
+# and of the parts of a chained exception traceback
+_TRACEBACK_START_LINES = (
+    "Traceback (most recent call last):",
+    "Stack (most recent call last):",
+    "During handling of the above exception, another exception occurred:",
+    "The above exception was the direct cause of the following exception:",
+)
+_TRACEBACK_START_LINES_BYTES = tuple(line.encode() for line in _TRACEBACK_START_LINES)
+
+
+def _request_id_line_pattern_source(prefix_format: str) -> str:
+    before, placeholder, after = prefix_format.partition("{request_id}")
+    if not placeholder:
+        raise ValueError("prefix_format must contain {request_id}")
+    prefix = re.escape(before) + r'(?P<prefix_id>[^\s"]+?)' + re.escape(after)
+    json_field = r'"request_id": ?"(?P<json_id>[^"\\\s]+)"'
+    return r"^[^\n]*?(?:" + prefix + r"|" + json_field + r")"
+
+
+def request_id_line_pattern(prefix_format: str = DEFAULT_PREFIX_FORMAT) -> "re.Pattern[str]":
+    """
+    Compile a regex matching log lines containing a request id - either in
+    the request id prefix built from prefix_format (the same format as passed
+    to setup_logging_request_id_prefix) or in a JSON "request_id" field.
+
+    Every match starts at the beginning of a line; the request id is
+    in the "prefix_id" or in the "json_id" group.
+    """
+    return re.compile(_request_id_line_pattern_source(prefix_format), re.MULTILINE)
+
+
+def request_id_line_bytes_pattern(prefix_format: str = DEFAULT_PREFIX_FORMAT) -> "re.Pattern[bytes]":
+    """
+    The same as request_id_line_pattern, for matching bytes (UTF-8).
+    """
+    return re.compile(_request_id_line_pattern_source(prefix_format).encode(), re.MULTILINE)
+
+
+def get_line_request_id(pattern: "re.Pattern[str]", line: str) -> str | None:
+    """
+    Return the request id found in the line by a request_id_line_pattern,
+    or None.
+    """
+    m = pattern.match(line)
+    if m is None:
+        return None
+    return m.group("prefix_id") or m.group("json_id")
+
+
+class ContinuationLineTracker:
+    """
+    Recognizes continuation lines of multi-line log records - a traceback
+    logged by logger.exception(), or any indented or empty line - among
+    the lines without a request id, which belong to the log line before them.
+
+    Feed it the lines in order: call is_continuation() for every line without
+    a request id and reset() for every line with one. Works with both str
+    and bytes lines (with or without the line end).
+    """
+
+    __slots__ = ("_in_traceback",)
+
+    def __init__(self):
+        # whether the previous line was a part of a traceback
+        self._in_traceback = False
+
+    def reset(self) -> None:
+        self._in_traceback = False
+
+    def is_continuation(self, line: str | bytes) -> bool:
+        if not line.strip() or line[:1].isspace():
+            return True
+        if line.startswith(_TRACEBACK_START_LINES) if isinstance(line, str) else line.startswith(_TRACEBACK_START_LINES_BYTES):
+            self._in_traceback = True
+            return True
+        if self._in_traceback:
+            # the "ValueError: message" line ending the traceback
+            self._in_traceback = False
+            return True
+        return False
@@ -2,8 +2,10 @@ import logging
 
 from aiohttp import web
 from aiohttp.web_log import AccessLogger as _AccessLogger
+from collections.abc import Callable
 
-from .context import request_id, REQUEST_ID_KEY
+from .context import request_id, pending_request_start, request_log_level, REQUEST_ID_KEY, FOLDED_REQUEST_START_KEY
+from .exclusions import PathExclusions
 
 
 def setup_logging_request_id_prefix(prefix_format: str = "[req:{request_id}] ") -> None:
@@ -20,6 +22,10 @@ def setup_logging_request_id_prefix(prefix_format: str = "[req:{request_id}] ")
     Safe to call multiple times - the setup is done only once; subsequent
     calls do nothing, even when called with a different prefix_format
     (the format from the first call stays in effect).
+
+    The record factory also logs a deferred request start message
+    (RequestIdMiddleware(request_start_delay=...)) right before any other
+    log record of the request.
     """
     # make sure we are doing this only once
     if getattr(logging, "request_id_log_record_factory_set_up", False):
@@ -29,6 +35,9 @@ def setup_logging_request_id_prefix(prefix_format: str = "[req:{request_id}] ")
     old_factory = logging.getLogRecordFactory()
 
     def new_factory(*args, **kwargs):
+        log_pending_request_start = pending_request_start.get()
+        if log_pending_request_start is not None:
+            log_pending_request_start()
         record = old_factory(*args, **kwargs)
         req_id = request_id.get()
         record.request_id = req_id
@@ -38,6 +47,51 @@ def setup_logging_request_id_prefix(prefix_format: str = "[req:{request_id}] ")
     logging.setLogRecordFactory(new_factory)
 
 
+def setup_request_log_level() -> Callable[[], None]:
+    """
+    Make the loggers enabled also for the levels allowed by the log level
+    of the current request - set in the request_log_level ContextVar by
+    RequestIdMiddleware(get_request_log_level=...) - not just for the levels
+    allowed by the logger level. Keep the logger levels at e.g. INFO and
+    return logging.DEBUG from get_request_log_level for the requests that
+    should be logged in detail.
+
+    Wraps logging.Logger.isEnabledFor: the request log level is read only
+    when the usual (cached) level check fails, so logger.debug() in the other
+    requests still returns without creating a log record. Handler levels
+    still apply - leave them unset (NOTSET) for the debug records to pass.
+
+    Returns a function that restores the original logging.Logger.isEnabledFor
+    (e.g. in test teardown). Safe to call multiple times - the setup is done
+    only once, and the same function is returned.
+    """
+    uninstall = getattr(logging, "request_log_level_set_up", None)
+    if callable(uninstall):
+        return uninstall
+
+    original_is_enabled_for = logging.Logger.isEnabledFor
+
+    def isEnabledFor(self: logging.Logger, level: int) -> bool:
+        if original_is_enabled_for(self, level):
+            return True
+        request_level = request_log_level.get()
+        if request_level is None or level < request_level:
+            return False
+        # logging.disable() and disabled loggers win over the request level
+        return not self.disabled and self.manager.disable < level
+
+    def uninstall() -> None:
+        # not if it was wrapped again by someone else in the meantime
+        if logging.Logger.isEnabledFor is isEnabledFor:
+            logging.Logger.isEnabledFor = original_is_enabled_for
+        if getattr(logging, "request_log_level_set_up", None) is uninstall:
+            del logging.request_log_level_set_up  # ty: ignore[unresolved-attribute]
+
+    logging.Logger.isEnabledFor = isEnabledFor
+    logging.request_log_level_set_up = uninstall  # ty: ignore[unresolved-attribute]
+    return uninstall
+
+
 class RequestIdAccessLogger(_AccessLogger):
     """
     Subclass of aiohttp.web_log.AccessLogger that sets the request_id
@@ -46,10 +100,21 @@ class RequestIdAccessLogger(_AccessLogger):
     Needed because aiohttp writes the access log outside of the middleware
     scope, where the ContextVar is already reset.
 
+    If the request start message of the request was not logged
+    (RequestIdMiddleware(request_start_delay=...)), its details - the handler
+    name - are appended to the access log line.
+
+    Requests to excluded_paths (a PathExclusions instance, set in
+    a subclass - aiohttp creates the access logger itself) are not logged.
+
     Usage: run_app(app, access_log_class=RequestIdAccessLogger)
     """
 
+    excluded_paths: PathExclusions | None = None
+
     def log(self, request: web.BaseRequest, response: web.StreamResponse, time: float) -> None:
+        if self.excluded_paths is not None and request.path in self.excluded_paths:
+            return
         try:
             request_id_value = request[REQUEST_ID_KEY]
         except KeyError:
@@ -59,8 +124,28 @@ class RequestIdAccessLogger(_AccessLogger):
             super().log(request, response, time)
             return
 
+        folded_request_start = request.get(FOLDED_REQUEST_START_KEY)
         token = request_id.set(request_id_value)
         try:
-            super().log(request, response, time)
+            if folded_request_start:
+                # AccessLogger.log builds the message and calls self.logger.info
+                # all at once - append the folded details there
+                access_logger = self.logger
+                self.logger = _SuffixLoggerAdapter(access_logger, f" ({folded_request_start})")
+                try:
+                    super().log(request, response, time)
+                finally:
+                    self.logger = access_logger
+            else:
+                super().log(request, response, time)
         finally:
             request_id.reset(token)
+
+
+class _SuffixLoggerAdapter(logging.LoggerAdapter):
+    def __init__(self, logger: logging.Logger | logging.LoggerAdapter, suffix: str):
+        super().__init__(logger, {})
+        self.suffix = suffix
+
+    def process(self, msg, kwargs):
+        return f"{msg}{self.suffix}", kwargs
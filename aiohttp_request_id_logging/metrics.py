@@ -0,0 +1,66 @@
+"""
+In-process metrics collected by RequestIdMiddleware.
+
+Every metrics object has a snapshot() method returning plain dicts
+(JSON-serializable), collected by RequestIdMiddleware.metrics_snapshot().
+"""
+
+from .fork_reset import register_fork_reset
+
+
+class _CancelledRouteCounters:
+    __slots__ = ("count", "wall_time", "cpu_time")
+
+    def __init__(self):
+        self.count = 0
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+
+
+class CancelledRequestStats:
+    """
+    Per-route counters of cancelled requests (client disconnects, timeouts):
+    how many requests were cancelled, and how much wall clock time and
+    CPU time their handlers spent before the cancellation.
+
+    Routes are identified as "GET /users/{user_id}" (the route template,
+    not the actual path; RequestIdMiddleware reports a request method
+    it does not know as "OTHER"). As a safeguard against routes built from
+    client-controlled values, at most max_routes counters are kept - the
+    requests of any further routes are counted under OVERFLOW_ROUTE.
+    """
+
+    OVERFLOW_ROUTE = "(other routes)"
+
+    def __init__(self, max_routes: int = 1000):
+        if max_routes < 1:
+            raise ValueError("max_routes must be at least 1")
+        self.max_routes = max_routes
+        self._routes: dict[str, _CancelledRouteCounters] = {}
+        register_fork_reset(self)
+
+    def record(self, route: str, wall_time: float, cpu_time: float) -> None:
+        counters = self._routes.get(route)
+        if counters is None:
+            if len(self._routes) >= self.max_routes:
+                route = self.OVERFLOW_ROUTE
+                counters = self._routes.get(route)
+            if counters is None:
+                counters = self._routes[route] = _CancelledRouteCounters()
+        counters.count += 1
+        counters.wall_time += wall_time
+        counters.cpu_time += cpu_time
+
+    def snapshot(self) -> dict[str, dict[str, float]]:
+        """
+        Return {route: {"count": ..., "wall_time": ..., "cpu_time": ...}},
+        times in seconds.
+        """
+        return {route: {"count": c.count, "wall_time": c.wall_time, "cpu_time": c.cpu_time} for route, c in self._routes.items()}
+
+    def reset(self) -> None:
+        self._routes.clear()
+
+    def _after_fork_in_child(self) -> None:
+        # do not report the requests of the parent process again
+        self.reset()
@@ -1,20 +1,46 @@
-from aiohttp import web
+from aiohttp import hdrs, web
 from aiohttp.typedefs import Handler
 from aiohttp.web_exceptions import HTTPException
-from asyncio import CancelledError
-from collections.abc import Callable
+from asyncio import CancelledError, TimerHandle, get_running_loop
+from collections import deque
+from collections.abc import Callable, Iterator
 from contextlib import AbstractContextManager, ExitStack
+from contextvars import Token
+from functools import partial
+from itertools import count
+from inspect import ismethod
 from logging import getLogger
+from time import perf_counter
+import tracemalloc
 from typing import Any
 import warnings
-
-from .context import REQUEST_ID_KEY, FALLBACK_REQUEST_ID_KEY, request_id as request_id_cv
+from weakref import WeakKeyDictionary
+
+from .accounting import ALLOCATION_PROBES, RequestUsage, run_with_step_hook
+from .context import (
+    REQUEST_ID_KEY,
+    FALLBACK_REQUEST_ID_KEY,
+    FOLDED_REQUEST_START_KEY,
+    child_request_id_counter,
+    pending_request_start,
+    request_log_level,
+    request_id as request_id_cv,
+)
 from .errors import RequestIdKeyAlreadySetError
+from .exclusions import PathExclusions
+from .metrics import CancelledRequestStats
+from .profiling import RequestProfiler
+from . import sentry
+from .sentry import install_sentry_event_processor
 from .request_id_factories import random_request_id_factory
 
 
 logger = getLogger(__name__)
 
+# RequestIdMiddleware._sentry_make_scope value meaning "use the module level
+# sentry.current_make_scope"
+_USE_MODULE_MAKE_SCOPE = object()
+
 
 def noop(*args: Any, **kwargs: Any) -> None:
     """
@@ -39,12 +65,21 @@ class RequestIdMiddleware:
     - get_request_id: callable (request) returning the request id for the
       given request, or None to have one generated with request_id_factory;
       if you adopt an incoming header value here, validate it - it is
-      controlled by the client
+      controlled by the client (IncomingRequestIdHeader does that)
     - log_request_start: callable (request, handler) that logs the request
       start message, replacing the default "Processing GET / (...)" one;
       pass noop to disable the message
     - log_function_name: include the handler name in the default request
       start message; default: True
+    - log_route_template: log the template of the matched route
+      ("Processing GET /users/{user_id}") instead of the actual path
+      in the default request start message; default: False
+    - request_start_delay: defer the request start message - it is logged
+      only if the request runs longer than this many seconds, or right before
+      any other log message of the request (needs
+      setup_logging_request_id_prefix()); otherwise the handler name is
+      appended to the RequestIdAccessLogger line instead, so a fast request
+      produces a single log line; default: None (log it right away)
     - add_response_request_id_header: callable (response, req_id) that adds
       the request id header to the response, replacing the default behavior
       (which keeps a header already set by the handler); pass noop to
@@ -54,19 +89,53 @@ class RequestIdMiddleware:
     - no_fallback_request_id_key: if True, store the request id only under
       REQUEST_ID_KEY and not under the backward compatibility plain string
       key request['request_id']; default: False
+    - track_cancelled_requests: if True, count the cancelled requests
+      (client disconnects, timeouts) per route together with the wall clock
+      and CPU time their handlers spent before the cancellation, see
+      metrics_snapshot(); measuring the CPU time has a small overhead
+      on every request; default: False
+    - log_resource_usage: log the thread CPU time the handler spent
+      computing (not waiting) at the end of every request - the handler
+      coroutine only, not the tasks it creates; with request_start_delay,
+      appended to the access log line if the request start message was not
+      logged; default: False
+    - allocation_accounting: with log_resource_usage (required), log also
+      the memory allocated by the handler - "blocks" (sys.getallocatedblocks)
+      or "tracemalloc" (bytes; tracemalloc must be started); default: None
+    - profiler: a RequestProfiler instance - profile the requests it selects
+      with a sampling profiler, writing a collapsed stack file per request
+      id; default: None
+    - lazy_sentry_scope: if True, do not create a Sentry scope for every
+      request - the request_id tag is added by a global Sentry event
+      processor only to the events that are actually captured; default: False
+    - excluded_paths: a PathExclusions instance - requests to these paths
+      (health checks, metrics scrapes) are passed to the handler with no
+      processing at all; default: None
+    - reentrant: if True, a request that already has a request id
+      (request[REQUEST_ID_KEY] - set by the same middleware applied also
+      to a parent application) is passed straight to the handler, instead
+      of raising RequestIdKeyAlreadySetError; default: False
+    - get_request_log_level: callable (request) returning the log level
+      (e.g. logging.DEBUG) for the given request, or None; the level is set
+      in the request_log_level ContextVar and the loggers are enabled for it
+      (needs setup_request_log_level()); if you take it from a request
+      header, check that the header is trusted - it is controlled by the
+      client
 
     The behavior can also be customized by subclassing - overriding the class
-    attributes (request_id_header_name, log_function_name) or the methods:
-    get_request_id, before_request, after_request,
-    get_response_for_exception, log_request_start, set_request_keys,
-    setup_sentry_scope, add_response_request_id_header, get_function_name.
+    attributes (request_id_header_name, log_function_name, log_route_template,
+    request_start_delay, log_resource_usage, reentrant)
+    or the methods: get_request_id, get_request_log_level, before_request, after_request,
+    get_response_for_exception, log_request_start, log_request_usage, set_request_keys,
+    setup_sentry_scope, add_response_request_id_header, on_response_prepare,
+    get_function_name, get_route_template.
 
     Functions stored in class attributes are tricky (Python would bind them
     as methods), that is why callables like request_id_factory are passed
     via the constructor parameters instead.
 
-    The get_request_id, log_request_start and add_response_request_id_header
-    parameters take precedence over the methods of the same name - when the
+    The get_request_id, get_request_log_level, log_request_start and
+    add_response_request_id_header parameters take precedence over the methods of the same name - when the
     parameter is passed, the method (even one overridden in a subclass) is
     not called.
 
@@ -80,6 +149,10 @@ class RequestIdMiddleware:
     # (plain values only - a function here would be bound as a method)
     request_id_header_name: str = "X-Request-Id"
     log_function_name: bool = True
+    log_route_template: bool = False
+    request_start_delay: float | None = None
+    log_resource_usage: bool = False
+    reentrant: bool = False
 
     def __init__(
         self,
@@ -88,9 +161,19 @@ class RequestIdMiddleware:
         get_request_id: Callable[[web.Request], str | None] | None = None,
         log_request_start: Callable[[web.Request, Handler], None] | None = None,
         log_function_name: bool | None = None,
+        log_route_template: bool | None = None,
+        request_start_delay: float | None = None,
         add_response_request_id_header: Callable[[web.StreamResponse, str], None] | None = None,
         request_id_header_name: str | None = None,
         no_fallback_request_id_key: bool = False,
+        track_cancelled_requests: bool = False,
+        log_resource_usage: bool | None = None,
+        allocation_accounting: str | None = None,
+        profiler: RequestProfiler | None = None,
+        lazy_sentry_scope: bool = False,
+        excluded_paths: PathExclusions | None = None,
+        reentrant: bool | None = None,
+        get_request_log_level: Callable[[web.Request], int | None] | None = None,
     ):
         # Set self.request_id_factory
         if request_id_factory is None:
@@ -105,6 +188,12 @@ class RequestIdMiddleware:
             raise TypeError("get_request_id must be a callable")
         self._get_request_id_override = get_request_id
 
+        # Set self._get_request_log_level_override, used instead of the
+        # get_request_log_level method (see before_request)
+        if get_request_log_level is not None and not callable(get_request_log_level):
+            raise TypeError("get_request_log_level must be a callable")
+        self._get_request_log_level_override = get_request_log_level
+
         # Set self._log_request_start_override, used instead of the
         # log_request_start method (see before_request)
         if log_request_start is not None and not callable(log_request_start):
@@ -117,11 +206,30 @@ class RequestIdMiddleware:
         if not isinstance(self.log_function_name, bool):
             raise TypeError("log_function_name must be a bool")
 
+        # Set self.log_route_template
+        if log_route_template is not None:
+            self.log_route_template = log_route_template
+        if not isinstance(self.log_route_template, bool):
+            raise TypeError("log_route_template must be a bool")
+        # route -> request start message without the method
+        self._route_start_messages: dict[Any, str] = {}
+
+        # Set self.request_start_delay
+        if request_start_delay is not None:
+            self.request_start_delay = request_start_delay
+        if self.request_start_delay is not None:
+            if not isinstance(self.request_start_delay, (int, float)) or isinstance(self.request_start_delay, bool):
+                raise TypeError("request_start_delay must be a number or None")
+            if self.request_start_delay < 0:
+                raise ValueError("request_start_delay must not be negative")
+
         # Set self._add_response_request_id_header_override, used instead of the
         # add_response_request_id_header method (see after_request)
         if add_response_request_id_header is not None and not callable(add_response_request_id_header):
             raise TypeError("add_response_request_id_header must be a callable; pass noop to disable the header")
         self._add_response_request_id_header_override = add_response_request_id_header
+        # set by setup_response_prepare_header()
+        self._header_on_response_prepare = False
 
         # Set self.request_id_header_name
         if request_id_header_name is not None:
@@ -131,7 +239,60 @@ class RequestIdMiddleware:
 
         self._fallback_request_id_key = None if no_fallback_request_id_key else FALLBACK_REQUEST_ID_KEY
 
-        self.sentry_make_scope = self.resolve_sentry_make_scope()
+        self.cancelled_requests = CancelledRequestStats() if track_cancelled_requests else None
+
+        # Set self.log_resource_usage
+        if log_resource_usage is not None:
+            self.log_resource_usage = log_resource_usage
+        if not isinstance(self.log_resource_usage, bool):
+            raise TypeError("log_resource_usage must be a bool")
+
+        # Set self._allocation_probe and self._allocation_unit
+        if allocation_accounting is None:
+            self._allocation_probe, self._allocation_unit = None, None
+        elif allocation_accounting in ALLOCATION_PROBES:
+            if not self.log_resource_usage:
+                # the allocations would be measured on every handler step
+                # (with track_cancelled_requests) and never logged
+                raise ValueError("allocation_accounting requires log_resource_usage=True")
+            self._allocation_probe, self._allocation_unit = ALLOCATION_PROBES[allocation_accounting]
+            if allocation_accounting == "tracemalloc" and not tracemalloc.is_tracing():
+                warnings.warn("allocation_accounting='tracemalloc' has no effect until tracemalloc is started", UserWarning)
+        else:
+            raise ValueError(f"allocation_accounting must be None or one of {', '.join(map(repr, ALLOCATION_PROBES))}")
+
+        self._measure_usage = self.cancelled_requests is not None or self.log_resource_usage
+
+        if profiler is not None and not isinstance(profiler, RequestProfiler):
+            raise TypeError("profiler must be a RequestProfiler instance")
+        self.profiler = profiler
+
+        if excluded_paths is not None and not isinstance(excluded_paths, PathExclusions):
+            raise TypeError("excluded_paths must be a PathExclusions instance")
+        # None instead of an empty PathExclusions, so that the check
+        # in __call__ is just an "is not None"
+        self.excluded_paths = excluded_paths if excluded_paths else None
+
+        # Set self.reentrant
+        if reentrant is not None:
+            self.reentrant = reentrant
+        if not isinstance(self.reentrant, bool):
+            raise TypeError("reentrant must be a bool")
+
+        # handler -> get_function_name(handler); the handlers are a small
+        # fixed set, and the entries go away together with the handlers
+        self._function_names: WeakKeyDictionary[Callable[..., Any], str] = WeakKeyDictionary()
+
+        self._sentry_make_scope: object
+        if lazy_sentry_scope:
+            install_sentry_event_processor()
+            self._sentry_make_scope = None
+        elif type(self).resolve_sentry_make_scope is RequestIdMiddleware.resolve_sentry_make_scope:
+            # resolve now (once) so that a missing scope function warns here
+            sentry.resolve_sentry_make_scope()
+            self._sentry_make_scope = _USE_MODULE_MAKE_SCOPE
+        else:
+            self._sentry_make_scope = self.resolve_sentry_make_scope()
 
     async def __call__(self, request: web.Request, handler: Handler) -> web.StreamResponse:
         """
@@ -145,24 +306,47 @@ class RequestIdMiddleware:
         response (get_response_for_exception). A raised HTTPException
         is re-raised for aiohttp to process - after after_request adds
         the request id header to it.
+
+        A cancelled handler (client disconnect, timeout) is logged together
+        with the time it ran, and counted if track_cancelled_requests is on.
+
+        Requests to excluded_paths go straight to the handler, and so do
+        requests that already have a request id if reentrant is on.
         """
+        if self.excluded_paths is not None and request.path in self.excluded_paths:
+            return await handler(request)
+        if self.reentrant and REQUEST_ID_KEY in request:
+            return await handler(request)
         if self._get_request_id_override is not None:
             req_id = self._get_request_id_override(request)
         else:
             req_id = self.get_request_id(request)
         if req_id is None:
             req_id = self.request_id_factory()
-        with ExitStack() as stack:
-            # Set request id context variable as a first thing
-            token = request_id_cv.set(req_id)
-            stack.callback(lambda: request_id_cv.reset(token))
-
+        # Set request id context variable as a first thing
+        # together with the child id counter shared by all the tasks of the request
+        with _RequestExitStack(request_id_cv.set(req_id), child_request_id_counter.set((req_id, count(1)))) as stack:
             await self.before_request(request, handler, req_id, stack)
 
+            usage = RequestUsage(self._allocation_probe) if self._measure_usage else None
+            if usage is not None and self.log_resource_usage:
+                stack.callback(self.log_request_usage, request, usage)
+            handler_call = handler(request)
+            if usage is not None:
+                handler_call = run_with_step_hook(handler_call, usage)
+            if self.profiler is not None and self.profiler.should_profile(request):
+                handler_call = self.profiler.profile(handler_call, req_id)
+            handler_start = perf_counter()
             try:
-                response = await handler(request)
+                response = await handler_call
             except CancelledError as exc:
-                logger.info("(Cancelled)")
+                duration = perf_counter() - handler_start
+                logger.info("(Cancelled after %.3f s)", duration)
+                if self.cancelled_requests is not None and usage is not None:
+                    # the method is chosen by the client - any token is accepted
+                    method = request.method if request.method in hdrs.METH_ALL else "OTHER"
+                    route = f"{method} {self.get_route_template(request) or '(unmatched)'}"
+                    self.cancelled_requests.record(route, duration, usage.cpu_time)
                 raise exc
             except HTTPException as http_exc:
                 # HTTPException is also the response aiohttp sends to the
@@ -199,30 +383,70 @@ class RequestIdMiddleware:
         """
         return None
 
+    def get_request_log_level(self, request: web.Request) -> int | None:
+        """
+        Return the log level for the given request (e.g. logging.DEBUG),
+        or None for the logger levels only (see setup_request_log_level).
+
+        The default implementation returns None. Override this to e.g.
+        enable debug logging for requests with a trusted header.
+
+        Not called when a get_request_log_level callable was passed to the
+        constructor - the callable is used instead (see before_request).
+        """
+        return None
+
     async def before_request(self, request: web.Request, handler: Handler, req_id: str, stack: ExitStack) -> None:
         """
         Called before the handler: store the request id in the request,
-        set up the Sentry scope and log the request start message.
+        set the request log level, set up the Sentry scope and log
+        the request start message.
 
         The stack parameter (a contextlib.ExitStack) can be used to register
         cleanup that runs after the request is processed.
 
-        This is where the log_request_start constructor parameter is applied -
-        when overriding this method without calling super(), taking the
-        parameter into account is up to you.
+        This is where the get_request_log_level and log_request_start
+        constructor parameters are applied - when overriding this method
+        without calling super(), taking them into account is up to you.
         """
         # Request keys come first so that the log_request_start hook can
         # read request[REQUEST_ID_KEY], and so that a double-applied
         # middleware raises RequestIdKeyAlreadySetError before producing
         # any side effects (Sentry scope, log message).
         self.set_request_keys(request, req_id)
+        if self._get_request_log_level_override is not None:
+            log_level = self._get_request_log_level_override(request)
+        else:
+            log_level = self.get_request_log_level(request)
+        if log_level is not None:
+            stack.callback(request_log_level.reset, request_log_level.set(log_level))
         # Sentry scope comes before the log message so that it is
         # captured in the scope (as a breadcrumb).
         self.setup_sentry_scope(req_id, stack)
         if self._log_request_start_override is not None:
-            self._log_request_start_override(request, handler)
+            log_request_start = self._log_request_start_override
+        else:
+            log_request_start = self.log_request_start
+        if self.request_start_delay is None:
+            log_request_start(request, handler)
         else:
-            self.log_request_start(request, handler)
+            self._defer_request_start(request, handler, log_request_start, stack)
+
+    def _defer_request_start(
+        self,
+        request: web.Request,
+        handler: Handler,
+        log_request_start: Callable[[web.Request, Handler], None],
+        stack: ExitStack,
+    ) -> None:
+        deferred = _DeferredRequestStart(request, handler, log_request_start)
+        deferred.token = pending_request_start.set(deferred)
+        # the timer callback runs in a copy of the current context,
+        # so the message gets the request id prefix
+        deferred.timer = get_running_loop().call_later(self.request_start_delay, deferred)  # ty: ignore[invalid-argument-type]
+        if self.log_function_name:
+            deferred.middleware = self
+        stack.push(deferred.__exit__)
 
     def get_response_for_exception(self, request: web.Request, exc: Exception) -> web.StreamResponse:
         """
@@ -251,24 +475,109 @@ class RequestIdMiddleware:
         This is where the add_response_request_id_header constructor
         parameter is applied - when overriding this method without calling
         super(), taking the parameter into account is up to you.
+
+        Does nothing after setup_response_prepare_header() - the header
+        is added when the response is prepared instead.
         """
+        if self._header_on_response_prepare:
+            return
         if self._add_response_request_id_header_override is not None:
             self._add_response_request_id_header_override(response, req_id)
         else:
             self.add_response_request_id_header(response, req_id)
 
+    def setup_response_prepare_header(self, app: web.Application) -> None:
+        """
+        Add the request id response header from the app.on_response_prepare
+        signal - right before the response headers are sent - instead of
+        in after_request. This way also streaming responses (StreamResponse,
+        Server-Sent Events, WebSockets) prepared inside the handler get
+        the header.
+
+        Call it for every app the middleware is used in:
+
+            middleware = RequestIdMiddleware()
+            app = web.Application(middlewares=[middleware])
+            middleware.setup_response_prepare_header(app)
+        """
+        app.on_response_prepare.append(self.on_response_prepare)
+        self._header_on_response_prepare = True
+
+    async def on_response_prepare(self, request: web.Request, response: web.StreamResponse) -> None:
+        """
+        The app.on_response_prepare signal handler installed by
+        setup_response_prepare_header() - adds the request id response
+        header, unless the response already contains it.
+
+        If an add_response_request_id_header callable was passed to the
+        constructor, it is called instead (note that response.prepared
+        is already True at this point, although the headers were not sent
+        yet).
+        """
+        req_id = request.get(REQUEST_ID_KEY)
+        if req_id is None:
+            # a response prepared outside of the middleware
+            return
+        if self._add_response_request_id_header_override is not None:
+            self._add_response_request_id_header_override(response, req_id)
+        elif self.request_id_header_name not in response.headers:
+            response.headers[self.request_id_header_name] = req_id
+
     def log_request_start(self, request: web.Request, handler: Handler) -> None:
         """
         Log the "Processing GET / (...)" message at the start of the request.
 
+        With log_route_template, the message contains the template of the
+        matched route instead of the path, and it is built only once per route.
+        Requests not matching any route (404) are logged with the path.
+
         Not called when a log_request_start callable was passed to the
         constructor - the callable is used instead (see before_request).
         """
+        if self.log_route_template:
+            # keyed by the route only - the method of a "*" route is chosen
+            # by the client, so it is not a part of the cached message
+            route = request.match_info.route
+            message = self._route_start_messages.get(route)
+            if message is None:
+                template = self.get_route_template(request)
+                if template is not None:
+                    if self.log_function_name:
+                        message = f"{template} ({self._get_cached_function_name(handler)})"
+                    else:
+                        message = template
+                    self._route_start_messages[route] = message
+            if message is not None:
+                logger.info("Processing %s %s", request.method, message)
+                return
         if self.log_function_name:
-            logger.info("Processing %s %s (%s)", request.method, request.path, self.get_function_name(handler))
+            logger.info("Processing %s %s (%s)", request.method, request.path, self._get_cached_function_name(handler))
         else:
             logger.info("Processing %s %s", request.method, request.path)
 
+    def log_request_usage(self, request: web.Request, usage: RequestUsage) -> None:
+        """
+        Log the resources used by the handler at the end of the request
+        (if log_resource_usage is on), e.g. "Resource usage: CPU 12.3 ms".
+
+        Only the steps of the handler coroutine itself are measured - not
+        the tasks it creates, even though they share the request id.
+
+        If the deferred request start message (request_start_delay) has not
+        been logged, the usage is appended to the access log line together
+        with the handler name instead, so that the request still produces
+        a single log line.
+        """
+        if self._allocation_probe is None:
+            message = f"Resource usage: CPU {usage.cpu_time * 1000:.1f} ms"
+        else:
+            message = f"Resource usage: CPU {usage.cpu_time * 1000:.1f} ms, allocated {usage.allocated} {self._allocation_unit}"
+        deferred = pending_request_start.get()
+        if isinstance(deferred, _DeferredRequestStart) and not deferred.done:
+            deferred.usage = message
+        else:
+            logger.info("%s", message)
+
     def set_request_keys(self, request: web.Request, req_id: str) -> None:
         """
         Store the request id in the request - under REQUEST_ID_KEY and,
@@ -280,11 +589,17 @@ class RequestIdMiddleware:
         request[REQUEST_ID_KEY] = req_id
 
         if self._fallback_request_id_key is not None:
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore", getattr(web, "NotAppKeyWarning", UserWarning))
-
-                if self._fallback_request_id_key in request:
-                    raise RequestIdKeyAlreadySetError(request[self._fallback_request_id_key])
+            if self._fallback_request_id_key in request:
+                raise RequestIdKeyAlreadySetError(request[self._fallback_request_id_key])
+            # aiohttp warns (NotAppKeyWarning) when a plain string key is
+            # stored in the request; storing this key is intentional, so it
+            # is written to the underlying mapping directly - without
+            # entering warnings.catch_warnings() on every request, which is
+            # costly and not thread-safe
+            state = getattr(request, "_state", None)
+            if isinstance(state, dict):
+                state[self._fallback_request_id_key] = req_id
+            else:
                 request[self._fallback_request_id_key] = req_id
 
     @staticmethod
@@ -293,42 +608,37 @@ class RequestIdMiddleware:
         Find the function for creating a new Sentry scope, or return None
         if sentry_sdk is not installed (or provides no such function).
 
-        For compatibility with sentry_sdk 1.x and 2.x:
-        push_scope is deprecated and will be removed, isolation_scope is its
-        recommended replacement for the request-response cycle.
+        The lookup is cached on the module level (see
+        aiohttp_request_id_logging.sentry.resolve_sentry_make_scope).
+        When this method is overridden in a subclass, its result is used
+        for the whole lifetime of the middleware instead of the module level
+        function that can be switched with set_sentry_scope_enabled().
         """
-        # Read sentry_sdk from the package at call time so that
-        # a replaced aiohttp_request_id_logging.sentry_sdk (e.g. monkeypatched
-        # in tests) is taken into account.
-        from . import sentry_sdk
+        return sentry.resolve_sentry_make_scope()
 
-        if sentry_sdk is None:
-            return None
-        try:
-            return sentry_sdk.isolation_scope
-        except AttributeError:
-            pass
-        try:
-            return sentry_sdk.push_scope
-        except AttributeError:
-            warnings.warn(
-                "sentry_sdk does not contain isolation_scope or push_scope. "
-                "This is most likely due to a version change to >2.x, "
-                "please consult the Sentry documentation on how to fix this. "
-                "The `request_id` tag will not be pushed to Sentry.",
-                UserWarning,
-            )
-            return None
+    @property
+    def sentry_make_scope(self) -> Callable[[], AbstractContextManager[Any]] | None:
+        """
+        The function called to create the per-request Sentry scope, or None.
+        """
+        if self._sentry_make_scope is _USE_MODULE_MAKE_SCOPE:
+            return sentry.current_make_scope
+        return self._sentry_make_scope  # ty: ignore[invalid-return-type]
+
+    @sentry_make_scope.setter
+    def sentry_make_scope(self, make_scope: Callable[[], AbstractContextManager[Any]] | None) -> None:
+        self._sentry_make_scope = make_scope
 
     def setup_sentry_scope(self, req_id: str, stack: ExitStack) -> None:
         """
         Create a new Sentry scope (entered into the given ExitStack)
         and add the request_id tag to it.
 
-        Does nothing if sentry_sdk is not installed.
+        Does nothing if sentry_sdk is not installed, or with lazy_sentry_scope=True.
         """
-        if self.sentry_make_scope is not None:
-            scope = stack.enter_context(self.sentry_make_scope())
+        make_scope = self.sentry_make_scope
+        if make_scope is not None:
+            scope = stack.enter_context(make_scope())
             scope.set_tag("request_id", req_id)
 
     def add_response_request_id_header(self, response: web.StreamResponse, req_id: str) -> None:
@@ -343,8 +653,8 @@ class RequestIdMiddleware:
         - the response was already prepared (a streaming or WebSocket
           handler called response.prepare()) - its headers were already
           sent to the client and cannot be changed anymore; to have the
-          header on streaming responses, set it in the handler before
-          calling prepare().
+          header on streaming responses, use setup_response_prepare_header(),
+          or set it in the handler before calling prepare().
 
         Not called when an add_response_request_id_header callable was
         passed to the constructor - the callable is used instead
@@ -362,16 +672,159 @@ class RequestIdMiddleware:
             # Let's consider this response header non critical
             logger.debug("Could not set response.headers[%r]: %r", self.request_id_header_name, e)
 
+    @staticmethod
+    def get_route_template(request: web.Request) -> str | None:
+        """
+        Return the template of the route matched by the request,
+        e.g. "/users/{user_id}", or None if no route was matched.
+        """
+        resource = request.match_info.route.resource
+        canonical = getattr(resource, "canonical", None)
+        return canonical if isinstance(canonical, str) else None
+
+    def metrics_snapshot(self) -> dict[str, Any]:
+        """
+        Return the metrics collected by the middleware as plain dicts:
+
+        - "cancelled_requests" - per-route counters of cancelled requests
+          (see CancelledRequestStats.snapshot), if track_cancelled_requests is on
+        """
+        snapshot: dict[str, Any] = {}
+        if self.cancelled_requests is not None:
+            snapshot["cancelled_requests"] = self.cancelled_requests.snapshot()
+        return snapshot
+
     @staticmethod
     def get_function_name(f: Callable[..., Any]) -> str:
         """
-        Return a human-readable handler name for the request start message.
+        Return a human-readable handler name for the request start message -
+        "module:function", "module:Class.method" for methods, "module:Class"
+        for class-based views and callable objects. functools.partial objects
+        are unwrapped.
         """
         try:
-            return f"{f.__module__}:{f.__name__}"  # ty: ignore[unresolved-attribute]
+            # aiohttp wraps handlers in partial objects too, but with the name
+            # of the handler copied by functools.update_wrapper
+            while isinstance(f, partial) and not hasattr(f, "__name__"):
+                f = f.func
+            if ismethod(f):
+                return f"{f.__module__}:{f.__qualname__}"
+            if not hasattr(f, "__name__"):
+                return f"{type(f).__module__}:{type(f).__qualname__}"
+            return f"{f.__module__}:{f.__name__}"
         except Exception:
             return str(f)
 
+    def _get_cached_function_name(self, f: Callable[..., Any]) -> str:
+        """
+        Return get_function_name(f), memoized per handler.
+        """
+        try:
+            return self._function_names[f]
+        except (KeyError, TypeError):
+            # TypeError - f cannot be weakly referenced
+            pass
+        name = self.get_function_name(f)
+        try:
+            self._function_names[f] = name
+        except TypeError:
+            pass
+        return name
+
+
+class _RequestExitStack(ExitStack[bool | None]):
+    """
+    The ExitStack passed to the before_request and after_request hooks,
+    also resetting the request_id and child_request_id_counter ContextVars
+    when the request is done - after all the other registered cleanup,
+    without allocating callbacks for it.
+
+    The tokens are optional, so that ExitStack.pop_all() - which creates
+    a new stack with type(self)() - works; a stack without them resets
+    nothing.
+    """
+
+    def __init__(
+        self,
+        token: Token[str | None] | None = None,
+        counter_token: Token[tuple[str, Iterator[int]] | None] | None = None,
+    ):
+        super().__init__()
+        # A list instead of the deque created by ExitStack - a deque takes
+        # several hundred bytes even when empty, which adds up with many
+        # in-flight requests (WebSockets, SSE). ExitStack only appends to
+        # and pops from the end of it. Replaced only when it is the expected
+        # deque, so that a different ExitStack implementation is left alone.
+        if type(getattr(self, "_exit_callbacks", None)) is deque:
+            self._exit_callbacks = []
+        self.token = token
+        self.counter_token = counter_token
+
+    def __exit__(self, *exc_details: Any) -> bool | None:
+        try:
+            return super().__exit__(*exc_details)
+        finally:
+            if self.counter_token is not None:
+                child_request_id_counter.reset(self.counter_token)
+            if self.token is not None:
+                request_id_cv.reset(self.token)
+
+
+class _DeferredRequestStart:
+    """
+    The deferred request start message - logs it when called, at most once.
+
+    Registered on the request's ExitStack: when the request is done,
+    the message is cancelled, and if it was not logged, the handler name
+    (if middleware is set) and the resource usage (if set) are stored
+    for the access log line.
+    """
+
+    __slots__ = ("request", "handler", "log_request_start", "timer", "done", "token", "middleware", "usage")
+
+    def __init__(self, request: web.Request, handler: Handler, log_request_start: Callable[[web.Request, Handler], None]):
+        self.request = request
+        self.handler = handler
+        self.log_request_start = log_request_start
+        self.timer: TimerHandle | None = None
+        self.done = False
+        self.token: Token[Callable[[], None] | None] | None = None
+        self.middleware: RequestIdMiddleware | None = None
+        self.usage: str | None = None
+
+    def __exit__(self, *exc_details: Any) -> None:
+        if self.token is not None:
+            pending_request_start.reset(self.token)
+        if not self.cancel():
+            return
+        if self.middleware is None:
+            folded = self.usage
+        elif self.usage is None:
+            folded = self.middleware._get_cached_function_name(self.handler)
+        else:
+            folded = f"{self.middleware._get_cached_function_name(self.handler)}, {self.usage}"
+        if folded is not None:
+            self.request[FOLDED_REQUEST_START_KEY] = folded
+
+    def __call__(self) -> None:
+        if self.done:
+            return
+        self.done = True
+        if self.timer is not None:
+            self.timer.cancel()
+        self.log_request_start(self.request, self.handler)
+
+    def cancel(self) -> bool:
+        """
+        Cancel the message; return True if it was not logged yet.
+        """
+        if self.done:
+            return False
+        self.done = True
+        if self.timer is not None:
+            self.timer.cancel()
+        return True
+
 
 def request_id_middleware(
     *,
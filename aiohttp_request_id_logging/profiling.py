@@ -0,0 +1,171 @@
+"""
+Sampling profiler for selected requests.
+"""
+
+from aiohttp import web
+from asyncio import get_running_loop
+from collections.abc import Awaitable, Iterable
+from logging import getLogger
+from pathlib import Path
+from random import random
+import re
+import sys
+from threading import Event, Lock, Thread, get_ident
+from time import sleep
+from types import FrameType
+from typing import TypeVar
+
+from .accounting import run_with_step_hook
+from .fork_reset import register_fork_reset
+
+
+T = TypeVar("T")
+
+logger = getLogger(__name__)
+
+
+class RequestProfiler:
+    """
+    Sampling profiler for selected requests, to be passed to
+    RequestIdMiddleware(profiler=...).
+
+    A request is profiled if it is selected by any of:
+
+    - sample_rate: the fraction of requests selected randomly (0.0 - 1.0)
+    - routes: route templates ("/users/{user_id}") whose requests are
+      always profiled
+    - header_name: requests carrying this header are always profiled;
+      make sure clients cannot send it (e.g. let the reverse proxy strip it)
+
+    The decision is made once, before the handler runs - requests that are
+    not selected are not slowed down at all.
+
+    While a profiled request handler is running (between its awaits),
+    a background thread samples its stack every interval seconds.
+    When the request finishes, the samples are written (in the event loop's
+    default executor) to output_dir/<request id>.collapsed in the
+    "collapsed stack" format ("frame;frame;frame count" lines) used by flame
+    graph tools (flamegraph.pl, speedscope, inferno).
+    """
+
+    def __init__(
+        self,
+        output_dir: str | Path,
+        *,
+        sample_rate: float = 0.0,
+        routes: Iterable[str] = (),
+        header_name: str | None = None,
+        interval: float = 0.005,
+    ):
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError("sample_rate must be between 0.0 and 1.0")
+        if interval <= 0:
+            raise ValueError("interval must be positive")
+        self.output_dir = Path(output_dir)
+        self.sample_rate = sample_rate
+        self.routes = frozenset(routes)
+        self.header_name = header_name
+        self.interval = interval
+        # thread id -> the profile of the request whose handler step
+        # is running in that thread right now
+        self._running: dict[int, _RequestProfile] = {}
+        self._active_count = 0
+        self._has_work = Event()
+        self._lock = Lock()
+        self._thread: Thread | None = None
+        register_fork_reset(self)
+
+    def should_profile(self, request: web.Request) -> bool:
+        """
+        Decide whether the given request should be profiled.
+        """
+        if self.header_name is not None and self.header_name in request.headers:
+            return True
+        if self.routes and getattr(request.match_info.route.resource, "canonical", None) in self.routes:
+            return True
+        return self.sample_rate > 0 and random() < self.sample_rate
+
+    async def profile(self, awaitable: Awaitable[T], req_id: str) -> T:
+        """
+        Await the awaitable (a request handler call) while sampling its stack,
+        then write the collected samples to the output file.
+        """
+        profile = _RequestProfile(self, req_id)
+        with self._lock:
+            self._active_count += 1
+            self._has_work.set()
+            if self._thread is None:
+                self._thread = Thread(target=self._sample_loop, name="RequestProfiler", daemon=True)
+                self._thread.start()
+        try:
+            return await run_with_step_hook(awaitable, profile)
+        finally:
+            with self._lock:
+                self._active_count -= 1
+                if self._active_count == 0:
+                    self._has_work.clear()
+                samples = dict(profile.samples)
+            # the file is written in the default executor, not blocking the event
+            # loop - and not delaying the response; errors are only logged
+            get_running_loop().run_in_executor(None, self._write, req_id, samples)
+
+    def _after_fork_in_child(self) -> None:
+        # the sampler thread does not exist in the child, and the lock
+        # may have been held by it during the fork
+        self._running = {}
+        self._active_count = 0
+        self._has_work = Event()
+        self._lock = Lock()
+        self._thread = None
+
+    def _sample_loop(self) -> None:
+        while True:
+            self._has_work.wait()
+            sleep(self.interval)
+            if not self._running:
+                continue
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, profile in list(self._running.items()):
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stack = _collapse_stack(frame)
+                        profile.samples[stack] = profile.samples.get(stack, 0) + 1
+
+    def _write(self, req_id: str, samples: dict[str, int]) -> None:
+        path = self.output_dir / f"{_unsafe_file_name_chars.sub('_', req_id)}.collapsed"
+        try:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            path.write_text("".join(f"{stack} {count}\n" for stack, count in samples.items()))
+        except OSError as e:
+            logger.warning("Could not write request profile %s: %r", path, e)
+            return
+        logger.debug("Request profile written to %s (%d samples)", path, sum(samples.values()))
+
+
+_unsafe_file_name_chars = re.compile(r"[^A-Za-z0-9._-]")
+
+
+class _RequestProfile:
+    __slots__ = ("profiler", "req_id", "samples")
+
+    def __init__(self, profiler: RequestProfiler, req_id: str):
+        self.profiler = profiler
+        self.req_id = req_id
+        self.samples: dict[str, int] = {}
+
+    def step_started(self) -> None:
+        self.profiler._running[get_ident()] = self
+
+    def step_finished(self) -> None:
+        self.profiler._running.pop(get_ident(), None)
+
+
+def _collapse_stack(frame: FrameType | None) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{frame.f_globals.get('__name__', '?')}:{getattr(code, 'co_qualname', code.co_name)}")
+        frame = frame.f_back
+    names.reverse()
+    return ";".join(names)
@@ -1,5 +1,13 @@
-from os import getpid
+from itertools import count
+import os
+from os import urandom
 from secrets import token_urlsafe
+from string import ascii_lowercase, ascii_uppercase, digits
+from threading import Lock, local
+from time import time_ns
+import warnings
+
+from .fork_reset import register_fork_reset
 
 
 _SKIP_CHARS = "1lI2ZO0"
@@ -37,24 +45,40 @@ class SequentialRequestIdFactory:
     response header by default - pass add_response_request_id_header=noop
     to disable that. If the exposure is a concern, use the default
     random_request_id_factory instead.
+
+    Thread-safe: every thread takes its numbers from its own block of
+    block_size numbers, so the threads do not contend for a lock on every
+    id. With more threads, the ids are not strictly in the order they were
+    generated.
     """
 
     prefix_length: int = 4
+    block_size: int = 256
 
     def __init__(self):
-        self._pid: int | None = None
-        self._prefix: str | None = None
-        self._next_value: int = 0
+        self._prefix = self._generate_prefix()
+        self._blocks = count(0, self.block_size)
+        self._blocks_lock = Lock()
+        self._thread_state = local()
+        register_fork_reset(self)
 
     def __call__(self) -> str:
-        pid = getpid()
-        if pid != self._pid:
-            self._prefix = self._generate_prefix()
-            self._next_value = 0
-            self._pid = pid
-        value = self._next_value
-        self._next_value += 1
-        return f"{self._prefix}{value:04}"
+        try:
+            return f"{self._prefix}{next(self._thread_state.values):04}"
+        except (AttributeError, StopIteration):
+            # the first id in this thread, or the block is used up
+            with self._blocks_lock:
+                start = next(self._blocks)
+            values = self._thread_state.values = iter(range(start, start + self.block_size))
+            return f"{self._prefix}{next(values):04}"
+
+    def _after_fork_in_child(self) -> None:
+        # a forked worker gets its own prefix, so that its ids do not
+        # collide with the ids of the parent and the other workers
+        self._prefix = self._generate_prefix()
+        self._blocks = count(0, self.block_size)
+        self._blocks_lock = Lock()
+        self._thread_state = local()
 
     @classmethod
     def _generate_prefix(cls) -> str:
@@ -72,3 +96,235 @@ class SequentialRequestIdFactory:
 
 
 sequential_request_id_factory = SequentialRequestIdFactory()
+
+
+# base 62 digits in ASCII order, so that fixed-width encoded numbers sort
+# the same as the numbers
+_BASE62_DIGITS = digits + ascii_uppercase + ascii_lowercase
+_BASE62_PAIRS = [a + b for a in _BASE62_DIGITS for b in _BASE62_DIGITS]
+
+
+def _encode_base62_11(n: int) -> str:
+    # fixed width 11 chars (62 ** 11 > 2 ** 64), unrolled - two digits at a time
+    n, a = divmod(n, 3844)
+    n, b = divmod(n, 3844)
+    n, c = divmod(n, 3844)
+    n, d = divmod(n, 3844)
+    n, e = divmod(n, 3844)
+    return _BASE62_DIGITS[n] + _BASE62_PAIRS[e] + _BASE62_PAIRS[d] + _BASE62_PAIRS[c] + _BASE62_PAIRS[b] + _BASE62_PAIRS[a]
+
+
+class SnowflakeRequestIdFactory:
+    """
+    Alternative request id factory producing time-sortable ids, unique across
+    processes and hosts as long as every process has its own worker id,
+    like "0Bc3nGx0f2K" - a Snowflake-style 63-bit number
+    (milliseconds since epoch_ms, worker id, sequence number within the
+    millisecond) encoded as a fixed-width 11 character base 62 string.
+
+    The ids sort (as strings) in the order they were generated, so a log
+    store can range-scan by request id - see request_id_for_time().
+
+    The worker id (0 - 1023) identifies the process; it is taken from
+    the worker_id parameter or from the environment variable named
+    by worker_id_env_var ("REQUEST_ID_WORKER_ID"). Without them, a random
+    worker id is chosen (again in a forked child process) and a warning is
+    issued (not by the module-level snowflake_request_id_factory instance,
+    which also validates the environment variable only on its first call): two processes with the same worker id generate the same ids
+    whenever they generate one in the same millisecond, and with 40 processes
+    the chance that two of them share a random worker id is about 50 %.
+
+    Usage: RequestIdMiddleware(request_id_factory=snowflake_request_id_factory)
+
+    The same caveat as for SequentialRequestIdFactory applies: the ids
+    exposed to clients reveal the request rate and the worker ids.
+
+    Thread-safe: the sequence is updated under a lock held only for
+    a few integer operations.
+    """
+
+    # 2026-01-01 00:00:00 UTC
+    epoch_ms: int = 1_767_225_600_000
+    worker_id_env_var: str = "REQUEST_ID_WORKER_ID"
+
+    worker_id_bits = 10
+    sequence_bits = 12
+
+    # whether a random worker id is reported with a RuntimeWarning
+    _warn_random_worker_id = True
+
+    def __init__(self, worker_id: int | None = None):
+        if worker_id is not None:
+            self._check_worker_id(worker_id)
+        else:
+            # fail early on an invalid value; the variable is read again
+            # on the first call, in case it is set later
+            self._get_env_worker_id()
+        self._set_up(worker_id)
+
+    @classmethod
+    def _create_default(cls) -> "SnowflakeRequestIdFactory":
+        # the module-level instance is created at import time, even in
+        # applications that never use it - the environment variable is
+        # validated only on its first call, and no warning is issued
+        factory = cls.__new__(cls)
+        factory._warn_random_worker_id = False
+        factory._set_up(None)
+        return factory
+
+    def _set_up(self, worker_id: int | None) -> None:
+        self._fixed_worker_id = worker_id
+        # determined on the first call, so that the worker id environment
+        # variable can be set after import (e.g. in a post-fork hook)
+        self._worker_bits: int | None = None
+        self._last_ms = 0
+        self._sequence = 0
+        self._lock = Lock()
+        register_fork_reset(self)
+
+    def __call__(self) -> str:
+        worker_bits = self._worker_bits
+        if worker_bits is None:
+            worker_bits = self._worker_bits = self._get_worker_id() << self.sequence_bits
+        now_ms = time_ns() // 1_000_000 - self.epoch_ms
+        with self._lock:
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                self._sequence = 0
+            else:
+                # the same millisecond (or the clock went back) - keep the ids
+                # increasing; when the sequence runs out, borrow the next millisecond
+                self._sequence += 1
+                if self._sequence >> self.sequence_bits:
+                    self._last_ms += 1
+                    self._sequence = 0
+            ms, sequence = self._last_ms, self._sequence
+        return _encode_base62_11((ms << (self.worker_id_bits + self.sequence_bits)) | worker_bits | sequence)
+
+    def _after_fork_in_child(self) -> None:
+        # a random worker id is chosen again in the child
+        self._worker_bits = None
+        self._last_ms = 0
+        self._sequence = 0
+        self._lock = Lock()
+
+    def _get_worker_id(self) -> int:
+        if self._fixed_worker_id is not None:
+            return self._fixed_worker_id
+        worker_id = self._get_env_worker_id()
+        if worker_id is not None:
+            return worker_id
+        if self._warn_random_worker_id:
+            warnings.warn(
+                f"{type(self).__name__}: no worker id given (worker_id parameter or {self.worker_id_env_var} "
+                "environment variable), using a random one - processes with the same worker id generate duplicate ids",
+                RuntimeWarning,
+                stacklevel=3,
+            )
+        return int.from_bytes(urandom(2), "big") & ((1 << self.worker_id_bits) - 1)
+
+    def _get_env_worker_id(self) -> int | None:
+        env_value = os.environ.get(self.worker_id_env_var)
+        if not env_value:
+            return None
+        try:
+            worker_id = int(env_value)
+        except ValueError:
+            raise ValueError(f"{self.worker_id_env_var} must be an integer, not {env_value!r}") from None
+        return self._check_worker_id(worker_id)
+
+    @classmethod
+    def _check_worker_id(cls, worker_id: int) -> int:
+        if not 0 <= worker_id < 1 << cls.worker_id_bits:
+            raise ValueError(f"worker_id must be between 0 and {(1 << cls.worker_id_bits) - 1}")
+        return worker_id
+
+    @classmethod
+    def request_id_for_time(cls, timestamp: float) -> str:
+        """
+        Return the lowest request id that could be generated at the given
+        time (time.time() value) - for range-scanning logs by request id.
+        """
+        ms = int(timestamp * 1000) - cls.epoch_ms
+        return _encode_base62_11(max(ms, 0) << (cls.worker_id_bits + cls.sequence_bits))
+
+
+snowflake_request_id_factory = SnowflakeRequestIdFactory._create_default()
+
+
+# Crockford's base 32 digits (used by ULID) are in ASCII order, so that
+# fixed-width encoded numbers sort the same as the numbers
+_CROCKFORD_DIGITS = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_CROCKFORD_PAIRS = [a + b for a in _CROCKFORD_DIGITS for b in _CROCKFORD_DIGITS]
+
+
+def _encode_ulid(ms: int, rnd: int) -> str:
+    # 48-bit timestamp as 10 digits and 80 random bits as 16 digits,
+    # unrolled - two digits (10 bits) at a time
+    p = _CROCKFORD_PAIRS
+    return "".join(
+        (
+            p[ms >> 40],
+            p[(ms >> 30) & 1023],
+            p[(ms >> 20) & 1023],
+            p[(ms >> 10) & 1023],
+            p[ms & 1023],
+            p[rnd >> 70],
+            p[(rnd >> 60) & 1023],
+            p[(rnd >> 50) & 1023],
+            p[(rnd >> 40) & 1023],
+            p[(rnd >> 30) & 1023],
+            p[(rnd >> 20) & 1023],
+            p[(rnd >> 10) & 1023],
+            p[rnd & 1023],
+        )
+    )
+
+
+class UlidRequestIdFactory:
+    """
+    Alternative request id factory producing ULIDs (https://github.com/ulid/spec)
+    like "01KBZ4F9S7Q3M0VX2N8TB6R5WD" - 26 characters of Crockford's base 32,
+    a 48-bit millisecond timestamp followed by 80 random bits.
+
+    The ids sort (as strings) by time; ids generated within the same
+    millisecond are monotonic - the random part of the previous id plus one.
+
+    Thread-safe: every thread has its own monotonic sequence, ids generated
+    by different threads within the same millisecond are ordered randomly.
+
+    Usage: RequestIdMiddleware(request_id_factory=ulid_request_id_factory)
+
+    The timestamp in the id reveals when the request was processed.
+    """
+
+    def __init__(self):
+        self._thread_state = _UlidThreadState()
+        register_fork_reset(self)
+
+    def __call__(self) -> str:
+        state = self._thread_state
+        now_ms = time_ns() // 1_000_000
+        if now_ms > state.last_ms:
+            state.last_ms = now_ms
+            state.last_random = int.from_bytes(urandom(10), "big")
+        else:
+            # the same millisecond (or the clock went back) - keep the ids
+            # increasing; when the random part overflows, borrow the next millisecond
+            state.last_random += 1
+            if state.last_random >> 80:
+                state.last_ms += 1
+                state.last_random = 0
+        return _encode_ulid(state.last_ms, state.last_random)
+
+    def _after_fork_in_child(self) -> None:
+        # do not continue the random sequence of the parent process
+        self._thread_state = _UlidThreadState()
+
+
+class _UlidThreadState(local):
+    last_ms = 0
+    last_random = 0
+
+
+ulid_request_id_factory = UlidRequestIdFactory()
@@ -0,0 +1,153 @@
+"""
+Sentry integration helpers.
+"""
+
+from collections.abc import Callable
+from contextlib import AbstractContextManager
+from typing import Any
+import warnings
+
+from .context import request_id
+
+
+MakeScope = Callable[[], AbstractContextManager[Any]]
+
+_UNRESOLVED = object()
+
+# the sentry_sdk module (object) the event processor was installed to
+_event_processor_installed_to: Any = None
+
+# the sentry_sdk module (object) _resolved_make_scope was resolved for
+_resolved_for: Any = _UNRESOLVED
+_resolved_make_scope: MakeScope | None = None
+_scope_enabled = True
+
+# The function RequestIdMiddleware calls to create the per-request Sentry
+# scope, or None - preselected by resolve_sentry_make_scope() and
+# set_sentry_scope_enabled(), so that the per-request code just reads it.
+current_make_scope: MakeScope | None = None
+
+
+def resolve_sentry_make_scope() -> MakeScope | None:
+    """
+    Find the function for creating a new Sentry scope, or return None
+    if sentry_sdk is not installed (or provides no such function).
+
+    For compatibility with sentry_sdk 1.x and 2.x:
+    push_scope is deprecated and will be removed, isolation_scope is its
+    recommended replacement for the request-response cycle.
+
+    The result is cached - the lookup is done again only when
+    aiohttp_request_id_logging.sentry_sdk is replaced (e.g. monkeypatched
+    in tests).
+    """
+    global _resolved_for, _resolved_make_scope, current_make_scope
+
+    # Read sentry_sdk from the package at call time so that
+    # a replaced aiohttp_request_id_logging.sentry_sdk is taken into account.
+    from . import sentry_sdk
+
+    if sentry_sdk is not _resolved_for:
+        _resolved_make_scope = _find_make_scope(sentry_sdk)
+        _resolved_for = sentry_sdk
+        current_make_scope = _resolved_make_scope if _scope_enabled else None
+    return _resolved_make_scope
+
+
+def set_sentry_scope_enabled(enabled: bool) -> None:
+    """
+    Switch the per-request Sentry scopes created by RequestIdMiddleware
+    on or off at runtime, without rebuilding the middleware - for example
+    switch them off until sentry_sdk.init() is called.
+    """
+    global _scope_enabled, current_make_scope
+
+    if not isinstance(enabled, bool):
+        raise TypeError("enabled must be a bool")
+    _scope_enabled = enabled
+    current_make_scope = resolve_sentry_make_scope() if enabled else None
+
+
+def _find_make_scope(sentry_sdk: Any) -> MakeScope | None:
+    if sentry_sdk is None:
+        return None
+    try:
+        return sentry_sdk.isolation_scope
+    except AttributeError:
+        pass
+    try:
+        return sentry_sdk.push_scope
+    except AttributeError:
+        warnings.warn(
+            "sentry_sdk does not contain isolation_scope or push_scope. "
+            "This is most likely due to a version change to >2.x, "
+            "please consult the Sentry documentation on how to fix this. "
+            "The `request_id` tag will not be pushed to Sentry.",
+            UserWarning,
+        )
+        return None
+
+
+def add_request_id_to_sentry_event(event: dict[str, Any], hint: dict[str, Any]) -> dict[str, Any]:
+    """
+    Sentry event processor adding the request_id tag to events captured
+    while a request is processed.
+    """
+    req_id = request_id.get()
+    if req_id is not None:
+        tags = event.get("tags")
+        if tags is None:
+            event["tags"] = {"request_id": req_id}
+        else:
+            tags.setdefault("request_id", req_id)
+    return event
+
+
+def add_request_id_to_sentry_breadcrumb(crumb: dict[str, Any], hint: dict[str, Any]) -> dict[str, Any]:
+    """
+    Sentry before_breadcrumb callback adding the request id to the data of
+    breadcrumbs recorded while a request is processed:
+
+        sentry_sdk.init(..., before_breadcrumb=add_request_id_to_sentry_breadcrumb)
+    """
+    req_id = request_id.get()
+    if req_id is not None:
+        data = crumb.get("data")
+        if data is None:
+            crumb["data"] = {"request_id": req_id}
+        else:
+            data.setdefault("request_id", req_id)
+    return crumb
+
+
+def install_sentry_event_processor() -> bool:
+    """
+    Install add_request_id_to_sentry_event as a global Sentry event processor.
+
+    Returns False if sentry_sdk is not installed (or provides no way to add
+    a global event processor). Safe to call multiple times - the processor
+    is installed only once.
+    """
+    global _event_processor_installed_to
+
+    # Read sentry_sdk from the package at call time so that
+    # a replaced aiohttp_request_id_logging.sentry_sdk (e.g. monkeypatched
+    # in tests) is taken into account.
+    from . import sentry_sdk
+
+    if sentry_sdk is None:
+        return False
+    if _event_processor_installed_to is sentry_sdk:
+        return True
+    try:
+        # sentry_sdk 2.x
+        add_event_processor = sentry_sdk.get_global_scope().add_event_processor
+    except AttributeError:
+        try:
+            # sentry_sdk 1.x
+            add_event_processor = sentry_sdk.scope.add_global_event_processor
+        except AttributeError:
+            return False
+    add_event_processor(add_request_id_to_sentry_event)
+    _event_processor_installed_to = sentry_sdk
+    return True
@@ -0,0 +1,136 @@
+"""
+Helpers for asyncio tasks spawned while processing a request.
+"""
+
+from asyncio import AbstractEventLoop, Future, Task, create_task, current_task, get_running_loop
+from collections.abc import Awaitable, Coroutine, Generator
+from contextvars import Context
+from itertools import count
+from typing import Any, TypeVar
+from weakref import WeakKeyDictionary
+
+from .context import child_request_id_counter, request_id
+
+
+T = TypeVar("T")
+
+# request id of the request that created the task, recorded by the task
+# factory installed with install_request_id_task_factory()
+_task_request_ids: "WeakKeyDictionary[Future[Any], str]" = WeakKeyDictionary()
+
+
+def child_request_id() -> str | None:
+    """
+    Return a new request id derived from the current one - "abc1234.1",
+    "abc1234.2"... for request "abc1234", "abc1234.1.1" for a child
+    of "abc1234.1" and so on. Returns None outside of a request.
+
+    The counter is shared by all the tasks of the request - RequestIdMiddleware
+    and with_child_request_id create it before the handler or the child runs.
+    For a request id set in some other way, the counter is created on the first
+    call, in the current context only.
+    """
+    parent_id = request_id.get()
+    if parent_id is None:
+        return None
+    state = child_request_id_counter.get()
+    # compared by identity, so that a request id set without a counter
+    # does not continue the counter of the previous one
+    if state is None or state[0] is not parent_id:
+        counter = count(1)
+        child_request_id_counter.set((parent_id, counter))
+    else:
+        counter = state[1]
+    return f"{parent_id}.{next(counter)}"
+
+
+def with_child_request_id(awaitable: Awaitable[T]) -> Coroutine[Any, Any, T]:
+    """
+    Wrap the awaitable so that it runs with a child request id
+    (see child_request_id) in the request_id ContextVar, and so with
+    the child id in the "[req:...]" log prefix.
+
+    The child id is derived right away, so the ids are numbered in the
+    order of the with_child_request_id calls. Usable with asyncio.gather
+    or TaskGroup:
+
+        await asyncio.gather(with_child_request_id(fetch(a)), with_child_request_id(fetch(b)))
+
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(with_child_request_id(fetch(a)))
+    """
+    return _run_with_request_id(awaitable, child_request_id())
+
+
+def create_child_task(awaitable: Awaitable[T], *, name: str | None = None) -> "Task[T]":
+    """
+    Shortcut for asyncio.create_task(with_child_request_id(awaitable)).
+    """
+    return create_task(with_child_request_id(awaitable), name=name)
+
+
+async def _run_with_request_id(awaitable: Awaitable[T], req_id: str | None) -> T:
+    if req_id is None:
+        return await awaitable
+    token = request_id.set(req_id)
+    counter_token = child_request_id_counter.set((req_id, count(1)))
+    try:
+        return await awaitable
+    finally:
+        child_request_id_counter.reset(counter_token)
+        request_id.reset(token)
+
+
+def install_request_id_task_factory(loop: AbstractEventLoop | None = None) -> None:
+    """
+    Install a task factory to the event loop (the running one by default)
+    that records the request id of the request creating each task,
+    readable later with get_task_request_id(task). The request id is taken
+    from the request_id ContextVar of the task's context, or, if it is not
+    set there, from the task creating it.
+
+    A task factory already set on the loop is kept - the new factory calls it
+    to create the task. Safe to call multiple times on the same loop.
+    """
+    if loop is None:
+        loop = get_running_loop()
+    previous_factory = loop.get_task_factory()
+    if getattr(previous_factory, "records_request_id", False):
+        return
+
+    def request_id_task_factory(loop: AbstractEventLoop, coro: Generator[Any, None, T] | Coroutine[Any, Any, T], **kwargs: Any) -> "Future[T]":
+        if previous_factory is None:
+            task = Task(coro, loop=loop, **kwargs)
+        else:
+            task = previous_factory(loop, coro, **kwargs)
+        context: Context | None = kwargs.get("context")
+        req_id = request_id.get() if context is None else context.get(request_id)
+        if req_id is None:
+            # e.g. a task created with an empty context by a task of a request
+            creating_task = current_task(loop)
+            if creating_task is not None:
+                req_id = _task_request_ids.get(creating_task)
+        if req_id is not None:
+            _task_request_ids[task] = req_id
+        return task
+
+    request_id_task_factory.records_request_id = True  # ty: ignore[unresolved-attribute]
+    loop.set_task_factory(request_id_task_factory)
+
+
+def get_task_request_id(task: "Task[Any] | None" = None) -> str | None:
+    """
+    Return the request id of the request that created the given task
+    (the current task by default), or None if the task was created outside
+    of a request or before install_request_id_task_factory() was called.
+
+    Useful for debug dumps, e.g.:
+
+        for task in asyncio.all_tasks():
+            print(get_task_request_id(task), task)
+    """
+    if task is None:
+        task = current_task()
+        if task is None:
+            return None
+    return _task_request_ids.get(task)
@@ -0,0 +1,93 @@
+"""
+Per-message request ids for long-lived WebSocket connections.
+"""
+
+from itertools import count
+from logging import getLogger
+from time import perf_counter
+from typing import Any
+
+from .context import child_request_id_counter, request_id
+
+
+logger = getLogger(__name__)
+
+
+class WebSocketMessageTracker:
+    """
+    Assigns a derived request id to every message received on a WebSocket
+    connection, and counts the messages and their processing time.
+
+    A WebSocket handler runs under one request id for the whole lifetime
+    of the connection; wrap the processing of every message with
+    tracker.message() and its log lines get the message id instead -
+    "abc1234.m1", "abc1234.m2"... for the connection request "abc1234":
+
+        async def websocket_handler(request):
+            ws = web.WebSocketResponse()
+            await ws.prepare(request)
+            tracker = WebSocketMessageTracker()
+            try:
+                async for msg in ws:
+                    with tracker.message():
+                        ...
+            finally:
+                tracker.log_summary()
+            return ws
+
+    The parent id is the current request id by default.
+    """
+
+    __slots__ = ("parent_id", "message_count", "processing_time")
+
+    def __init__(self, parent_id: str | None = None):
+        if parent_id is None:
+            parent_id = request_id.get()
+        if parent_id is None:
+            raise ValueError("WebSocketMessageTracker needs a parent_id when used outside of a request")
+        self.parent_id = parent_id
+        self.message_count = 0
+        self.processing_time = 0.0
+
+    def message(self) -> "_MessageScope":
+        """
+        Context manager for processing one message - sets the message id
+        in the request_id ContextVar and measures the processing time.
+        """
+        self.message_count += 1
+        return _MessageScope(self, f"{self.parent_id}.m{self.message_count}")
+
+    def snapshot(self) -> dict[str, Any]:
+        """
+        Return {"request_id": ..., "message_count": ..., "processing_time": ...},
+        processing time in seconds.
+        """
+        return {"request_id": self.parent_id, "message_count": self.message_count, "processing_time": self.processing_time}
+
+    def log_summary(self) -> None:
+        """
+        Log the message count and the total processing time - e.g. when
+        the connection is closed.
+        """
+        logger.info("WebSocket messages: %d, processing time %.3f s", self.message_count, self.processing_time)
+
+
+class _MessageScope:
+    __slots__ = ("tracker", "message_id", "_token", "_counter_token", "_start")
+
+    def __init__(self, tracker: WebSocketMessageTracker, message_id: str):
+        self.tracker = tracker
+        self.message_id = message_id
+
+    def __enter__(self) -> str:
+        self._token = request_id.set(self.message_id)
+        # child request ids within the message are derived from the message id,
+        # without advancing the counter of the connection request
+        self._counter_token = child_request_id_counter.set((self.message_id, count(1)))
+        self._start = perf_counter()
+        return self.message_id
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.tracker.processing_time += perf_counter() - self._start
+        child_request_id_counter.reset(self._counter_token)
+        request_id.reset(self._token)
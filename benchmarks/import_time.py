@@ -0,0 +1,64 @@
+"""
+Benchmark of the package import time - measured with python -X importtime
+in fresh interpreter processes, best of several runs, compared with importing
+just aiohttp.web (which the package cannot do without).
+
+Also reports which of the optional heavy dependencies (sentry_sdk) got
+imported - they should be imported only when first needed.
+
+Usage: uv run python benchmarks/import_time.py
+"""
+
+import subprocess
+import sys
+
+
+runs = 10
+
+heavy_modules = ["sentry_sdk"]
+
+
+def import_times(code):
+    """
+    Run code in a fresh process with -X importtime and return
+    {top-level module name: cumulative import time in microseconds}
+    and the set of all imported module names.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, check=True)
+    times = {}
+    imported = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # the header line
+        imported.add(name.strip())
+        if not name.startswith("  "):
+            times[name.strip()] = int(cumulative)
+    return times, imported
+
+
+def best_total_time(code):
+    # the sum of the top-level imports is the whole import time of the code
+    best = None
+    for _ in range(runs):
+        times, imported = import_times(code)
+        total = sum(times.values())
+        if best is None or total < best[0]:
+            best = (total, imported)
+    return best
+
+
+def main():
+    baseline, _ = best_total_time("import aiohttp.web")
+    package, imported = best_total_time("import aiohttp_request_id_logging")
+    print(f"{'import aiohttp.web':40} {baseline / 1000:8.1f} ms")
+    print(f"{'import aiohttp_request_id_logging':40} {package / 1000:8.1f} ms")
+    print(f"{'difference':40} {(package - baseline) / 1000:8.1f} ms")
+    for name in heavy_modules:
+        print(f"{name + ' imported':40} {'yes' if name in imported else 'no':>8}")
+
+
+if __name__ == "__main__":
+    main()
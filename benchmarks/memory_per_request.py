@@ -0,0 +1,60 @@
+"""
+Benchmark of the memory RequestIdMiddleware holds per in-flight request -
+measured with tracemalloc over many concurrent requests whose handlers wait
+(like WebSocket or SSE handlers), minus the memory of the same requests
+without the middleware.
+
+Usage: uv run python benchmarks/memory_per_request.py
+"""
+
+from asyncio import Event, create_task, gather, run, sleep
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+import tracemalloc
+
+from aiohttp_request_id_logging import RequestIdMiddleware
+
+
+concurrency = 2000
+
+
+async def measure(middleware):
+    release = Event()
+
+    async def handler(request):
+        await release.wait()
+        return web.Response()
+
+    requests = [make_mocked_request("GET", "/") for _ in range(concurrency)]
+    # trace only the request processing - creating mocked requests
+    # with tracemalloc on takes long
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    if middleware is None:
+        tasks = [create_task(handler(request)) for request in requests]
+    else:
+        tasks = [create_task(middleware(request, handler)) for request in requests]
+    await sleep(0)
+    in_flight = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    release.set()
+    await gather(*tasks)
+    return (in_flight - before) / concurrency
+
+
+async def main():
+    # warm up - caches, interned strings
+    await measure(RequestIdMiddleware(log_request_start=lambda request, handler: None))
+    baseline = await measure(None)
+    for label, middleware in [
+        ("default", RequestIdMiddleware(log_request_start=lambda request, handler: None)),
+        ("no_fallback_request_id_key", RequestIdMiddleware(log_request_start=lambda request, handler: None, no_fallback_request_id_key=True)),
+        ("request_start_delay=1", RequestIdMiddleware(request_start_delay=1)),
+        ("lazy_sentry_scope", RequestIdMiddleware(log_request_start=lambda request, handler: None, lazy_sentry_scope=True)),
+    ]:
+        with_middleware = await measure(middleware)
+        print(f"{label:32} {with_middleware - baseline:8.0f} bytes per in-flight request")
+
+
+if __name__ == "__main__":
+    run(main())
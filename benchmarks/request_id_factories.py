@@ -0,0 +1,68 @@
+"""
+Benchmark of the request id factories - the time per id in one thread,
+and the throughput with multiple threads generating ids at once
+(it scales with the thread count only on free-threaded Python).
+
+Usage: uv run python benchmarks/request_id_factories.py
+"""
+
+import os
+import sys
+from threading import Barrier, Thread
+from time import perf_counter
+from timeit import repeat
+
+from aiohttp_request_id_logging import (
+    random_request_id_factory,
+    sequential_request_id_factory,
+    snowflake_request_id_factory,
+    ulid_request_id_factory,
+)
+
+
+factories = [
+    ("random_request_id_factory", random_request_id_factory),
+    ("sequential_request_id_factory", sequential_request_id_factory),
+    ("snowflake_request_id_factory", snowflake_request_id_factory),
+    ("ulid_request_id_factory", ulid_request_id_factory),
+]
+
+
+def measure_throughput(factory, thread_count, ids_per_thread):
+    barrier = Barrier(thread_count + 1)
+
+    def generate():
+        barrier.wait()
+        for _ in range(ids_per_thread):
+            factory()
+
+    threads = [Thread(target=generate) for _ in range(thread_count)]
+    for t in threads:
+        t.start()
+    t0 = perf_counter()
+    barrier.wait()
+    for t in threads:
+        t.join()
+    return thread_count * ids_per_thread / (perf_counter() - t0)
+
+
+def main():
+    # read by snowflake_request_id_factory on its first call
+    os.environ.setdefault("REQUEST_ID_WORKER_ID", "1")
+    number = 100_000
+    for factory_name, factory in factories:
+        best = min(repeat(factory, number=number, repeat=5))
+        print(f"{factory_name:32} {best / number * 1e9:8.0f} ns per id")
+
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", lambda: True)()
+    print()
+    print(f"Throughput in thousands of ids per second (GIL {'enabled' if is_gil_enabled else 'disabled'}):")
+    thread_counts = [1, 2, 4, 8]
+    print(f"{'threads':32}" + "".join(f"{n:>8}" for n in thread_counts))
+    for factory_name, factory in factories:
+        results = [measure_throughput(factory, n, 50_000) for n in thread_counts]
+        print(f"{factory_name:32}" + "".join(f"{r / 1000:8.0f}" for r in results))
+
+
+if __name__ == "__main__":
+    main()
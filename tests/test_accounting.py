@@ -0,0 +1,74 @@
+from asyncio import CancelledError, create_task, run, sleep
+from pytest import raises
+
+from aiohttp_request_id_logging.accounting import RequestUsage, run_with_step_hook
+
+
+class CountingHook:
+    def __init__(self):
+        self.started = 0
+        self.finished = 0
+
+    def step_started(self):
+        assert self.started == self.finished
+        self.started += 1
+
+    def step_finished(self):
+        self.finished += 1
+
+
+def test_run_with_step_hook_returns_result():
+    async def compute():
+        await sleep(0)
+        await sleep(0)
+        return 42
+
+    hook = CountingHook()
+    assert run(run_with_step_hook(compute(), hook)) == 42
+    assert hook.started == hook.finished == 3
+
+
+def test_run_with_step_hook_propagates_exceptions():
+    async def fail():
+        await sleep(0)
+        raise ValueError("test exception")
+
+    hook = CountingHook()
+    with raises(ValueError):
+        run(run_with_step_hook(fail(), hook))
+    assert hook.started == hook.finished == 2
+
+
+def test_run_with_step_hook_propagates_cancellation():
+    cancelled = []
+
+    async def wait_forever():
+        try:
+            await sleep(3600)
+        except CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def scenario():
+        hook = CountingHook()
+        task = create_task(run_with_step_hook(wait_forever(), hook))
+        await sleep(0)
+        task.cancel()
+        with raises(CancelledError):
+            await task
+        return hook
+
+    hook = run(scenario())
+    assert cancelled == [True]
+    assert hook.started == hook.finished == 2
+
+
+def test_request_usage_measures_cpu_time():
+    async def compute():
+        await sleep(0)
+        sum(range(1_000_000))
+
+    usage = RequestUsage()
+    run(run_with_step_hook(compute(), usage))
+    assert usage.cpu_time_ns > 0
+    assert usage.cpu_time == usage.cpu_time_ns / 1e9
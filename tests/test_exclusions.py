@@ -0,0 +1,74 @@
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from asyncio import run
+from logging import INFO
+from pytest import raises
+
+from aiohttp_request_id_logging import PathExclusions, RequestIdAccessLogger, RequestIdMiddleware, request_id
+
+
+def test_path_exclusions_exact_paths_and_prefixes():
+    exclusions = PathExclusions(paths=["/healthz", "/metrics"], prefixes=["/probe/", "/internal/status"])
+    assert "/healthz" in exclusions
+    assert "/metrics" in exclusions
+    assert "/healthz/" not in exclusions
+    assert "/metrics2" not in exclusions
+    assert "/probe/" in exclusions
+    assert "/probe/live" in exclusions
+    assert "/probe" not in exclusions
+    assert "/internal/status" in exclusions
+    assert "/internal/status/db" in exclusions
+    assert "/internal/stat" not in exclusions
+    assert "/" not in exclusions
+    assert "" not in exclusions
+    assert exclusions
+
+
+def test_path_exclusions_empty_and_empty_prefix():
+    assert not PathExclusions()
+    assert "/" not in PathExclusions()
+    assert "/anything" in PathExclusions(prefixes=[""])
+
+
+def test_path_exclusions_rejects_str():
+    with raises(TypeError):
+        PathExclusions(paths="/healthz")
+    with raises(TypeError):
+        PathExclusions(prefixes="/probe/")
+
+
+def test_middleware_rejects_invalid_excluded_paths():
+    with raises(TypeError):
+        RequestIdMiddleware(excluded_paths=["/healthz"])  # ty: ignore[invalid-argument-type]
+
+
+def test_excluded_paths_bypass_middleware_and_access_log(caplog):
+    seen_request_ids = {}
+
+    class AccessLogger(RequestIdAccessLogger):
+        excluded_paths = PathExclusions(paths=["/healthz"])
+
+    async def handler(request):
+        seen_request_ids[request.path] = request_id.get()
+        return web.Response(text="ok")
+
+    async def scenario():
+        middleware = RequestIdMiddleware(excluded_paths=PathExclusions(paths=["/healthz"]))
+        app = web.Application(middlewares=[middleware])
+        app.router.add_get("/healthz", handler)
+        app.router.add_get("/hello", handler)
+        server = TestServer(app)
+        await server.start_server(access_log_class=AccessLogger)
+        async with TestClient(server) as client:
+            health_response = await client.get("/healthz")
+            hello_response = await client.get("/hello")
+        return health_response.headers, hello_response.headers
+
+    with caplog.at_level(INFO):
+        health_headers, hello_headers = run(scenario())
+    assert "X-Request-Id" not in health_headers
+    assert seen_request_ids["/healthz"] is None
+    assert seen_request_ids["/hello"] == hello_headers["X-Request-Id"]
+    messages = [r.getMessage() for r in caplog.records]
+    assert not any("/healthz" in message for message in messages)
+    assert any('"GET /hello HTTP/1.1" 200' in message for message in messages)
@@ -0,0 +1,42 @@
+import os
+
+from pytest import mark
+
+from aiohttp_request_id_logging import CancelledRequestStats, SequentialRequestIdFactory, UlidRequestIdFactory
+from aiohttp_request_id_logging.fork_reset import _reset_all_in_child
+
+
+def test_reset_after_fork_in_child():
+    factory = SequentialRequestIdFactory()
+    first = factory()
+    assert factory()[:4] == first[:4]
+    stats = CancelledRequestStats()
+    stats.record("GET /", 1.0, 0.5)
+    # what runs in a forked child
+    _reset_all_in_child()
+    second = factory()
+    assert second[:4] != first[:4]
+    assert second[4:] == "0000"
+    assert stats.snapshot() == {}
+
+
+@mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_forked_child_gets_new_ids():
+    sequential_factory = SequentialRequestIdFactory()
+    ulid_factory = UlidRequestIdFactory()
+    parent_ids = [sequential_factory(), ulid_factory()]
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.write(write_fd, f"{sequential_factory()} {ulid_factory()}".encode())
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        child_ids = f.read().split()
+    os.waitpid(pid, 0)
+    assert child_ids[0][:4] != parent_ids[0][:4]
+    assert child_ids[0][4:] == "0000"
+    # the random part of the ULID is not continued from the parent
+    assert child_ids[1][10:] != ulid_factory()[10:]
@@ -0,0 +1,67 @@
+from asyncio import run
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+from pytest import raises
+
+from aiohttp_request_id_logging import IncomingRequestIdHeader, RequestIdMiddleware, REQUEST_ID_KEY
+from aiohttp_request_id_logging.incoming_request_id import TrustedNetworks
+
+
+async def hello(request):
+    return web.Response(text="Hello, world!\n")
+
+
+def make_request(header_value=None, remote="127.0.0.1"):
+    headers = {} if header_value is None else {"X-Request-Id": header_value}
+    return make_mocked_request("GET", "/", headers=headers).clone(remote=remote)
+
+
+def test_incoming_request_id_header_adopts_valid_value():
+    get_request_id = IncomingRequestIdHeader()
+    assert get_request_id(make_request("from-proxy.1234")) == "from-proxy.1234"
+    assert get_request_id(make_request()) is None
+
+
+def test_incoming_request_id_header_rejects_invalid_values():
+    get_request_id = IncomingRequestIdHeader(max_length=10)
+    assert get_request_id(make_request("")) is None
+    assert get_request_id(make_request("x" * 11)) is None
+    assert get_request_id(make_request("x" * 10)) == "x" * 10
+    assert get_request_id(make_request("with space")) is None
+    assert get_request_id(make_request("badé")) is None
+    assert get_request_id(make_request("a]b")) is None
+
+
+def test_incoming_request_id_header_custom_allowed_chars():
+    get_request_id = IncomingRequestIdHeader(allowed_chars="0123456789abcdef-]")
+    assert get_request_id(make_request("abc-123]")) == "abc-123]"
+    assert get_request_id(make_request("xyz")) is None
+    with raises(ValueError):
+        IncomingRequestIdHeader(allowed_chars="")
+
+
+def test_incoming_request_id_header_checks_trusted_proxies():
+    get_request_id = IncomingRequestIdHeader(trusted_proxies=["10.0.0.0/8", "192.168.1.1", "fd00::/8"])
+    assert get_request_id(make_request("abc", remote="10.1.2.3")) == "abc"
+    assert get_request_id(make_request("abc", remote="192.168.1.1")) == "abc"
+    assert get_request_id(make_request("abc", remote="fd12::1")) == "abc"
+    assert get_request_id(make_request("abc", remote="::ffff:10.0.0.1")) == "abc"
+    assert get_request_id(make_request("abc", remote="192.168.1.2")) is None
+    assert get_request_id(make_request("abc", remote="11.0.0.1")) is None
+    assert get_request_id(make_request("abc", remote="/run/app.sock")) is None
+    assert get_request_id(make_request("abc", remote=None)) is None
+
+
+def test_trusted_networks_with_many_networks():
+    networks = TrustedNetworks(f"10.{i // 256}.{i % 256}.0/24" for i in range(10_000))
+    assert "10.39.15.200" in networks
+    assert "10.39.16.200" not in networks
+    assert "10.40.0.1" not in networks
+
+
+def test_middleware_with_incoming_request_id_header():
+    middleware = RequestIdMiddleware(get_request_id=IncomingRequestIdHeader())
+    request = make_request("from-proxy")
+    response = run(middleware(request, hello))
+    assert request[REQUEST_ID_KEY] == "from-proxy"
+    assert response.headers["X-Request-Id"] == "from-proxy"
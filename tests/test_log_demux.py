@@ -0,0 +1,138 @@
+import json
+
+from pytest import raises
+
+from aiohttp_request_id_logging.log_demux import LogDemultiplexer, demux_log_lines, main
+
+
+def access_line(req_id, status=200):
+    return f'INFO: [req:{req_id}] 127.0.0.1 "GET / HTTP/1.1" {status} 165 "-" "curl/7.68.0"\n'
+
+
+def test_lines_are_grouped_until_access_line():
+    lines = [
+        "INFO: [req:aaa] Processing GET / (__main__:hello)\n",
+        "INFO: [req:bbb] Processing GET / (__main__:hello)\n",
+        "INFO: Server is running\n",
+        "INFO: [req:aaa.1] Child task\n",
+        "ERROR: [req:bbb] Something bad has happened\n",
+        access_line("bbb", 500),
+        "INFO: [req:aaa] Done\n",
+        access_line("aaa"),
+    ]
+    assert list(demux_log_lines(lines)) == [
+        (None, ["INFO: Server is running\n"]),
+        ("bbb", ["INFO: [req:bbb] Processing GET / (__main__:hello)\n", "ERROR: [req:bbb] Something bad has happened\n", access_line("bbb", 500)]),
+        (
+            "aaa",
+            ["INFO: [req:aaa] Processing GET / (__main__:hello)\n", "INFO: [req:aaa.1] Child task\n", "INFO: [req:aaa] Done\n", access_line("aaa")],
+        ),
+    ]
+
+
+def test_traceback_lines_belong_to_the_group_of_their_record():
+    traceback_lines = [
+        "Traceback (most recent call last):\n",
+        '  File "app.py", line 10, in hello\n',
+        "    raise KeyError('x')\n",
+        "KeyError: 'x'\n",
+        "\n",
+        "During handling of the above exception, another exception occurred:\n",
+        "\n",
+        "Traceback (most recent call last):\n",
+        '  File "app.py", line 12, in hello\n',
+        "ValueError: boom\n",
+    ]
+    lines = [
+        "INFO: [req:aaa] Processing GET / (__main__:hello)\n",
+        "INFO: [req:bbb] Processing GET / (__main__:hello)\n",
+        "ERROR: [req:aaa] Error handling request: ValueError('boom')\n",
+        *traceback_lines,
+        "INFO: Server is running\n",
+        access_line("bbb"),
+        access_line("aaa", 500),
+    ]
+    assert list(demux_log_lines(lines)) == [
+        (None, ["INFO: Server is running\n"]),
+        ("bbb", ["INFO: [req:bbb] Processing GET / (__main__:hello)\n", access_line("bbb")]),
+        (
+            "aaa",
+            [
+                "INFO: [req:aaa] Processing GET / (__main__:hello)\n",
+                "ERROR: [req:aaa] Error handling request: ValueError('boom')\n",
+                *traceback_lines,
+                access_line("aaa", 500),
+            ],
+        ),
+    ]
+
+
+def test_traceback_of_a_line_without_request_id_is_released_with_it():
+    lines = ["ERROR: Startup failed\n", "Traceback (most recent call last):\n", "  File ...\n", "OSError: no\n", "INFO: Retrying\n"]
+    assert list(demux_log_lines(lines)) == [(None, [line]) for line in lines]
+
+
+def test_request_ids_containing_dots():
+    # a request id adopted from the client may contain "." - it is a child id
+    # only when its parent request is being collected
+    lines = [
+        "INFO: [req:1.2] Processing GET / (__main__:hello)\n",
+        "INFO: [req:1.2.1] Child task\n",
+        access_line("1.2"),
+        "INFO: [req:abc] Processing GET / (__main__:hello)\n",
+        "INFO: [req:abc.1.1] Grandchild task\n",
+        access_line("abc"),
+    ]
+    demux = LogDemultiplexer()
+    assert demux.feed(lines[0], now=0) == []
+    assert demux.feed(lines[1], now=0) == []
+    assert demux.feed(lines[2], now=0) == [("1.2", lines[0:3])]
+    assert demux.feed(lines[3], now=0) == []
+    assert demux.feed(lines[4], now=0) == []
+    assert demux.feed(lines[5], now=0) == [("abc", lines[3:6])]
+
+
+def test_json_lines():
+    lines = [
+        json.dumps({"message": "Processing GET /", "request_id": "aaa"}) + "\n",
+        json.dumps({"message": "Processing GET /", "request_id": "bbb"}) + "\n",
+        json.dumps({"message": '127.0.0.1 "GET / HTTP/1.1" 200 165 "-" "curl"', "request_id": "aaa"}) + "\n",
+    ]
+    assert [(req_id, len(group)) for req_id, group in demux_log_lines(lines)] == [("aaa", 2), ("bbb", 1)]
+
+
+def test_group_released_after_timeout():
+    demux = LogDemultiplexer(timeout=10, prefix_format="<{request_id}> ")
+    assert demux.feed("<aaa> one\n", now=0) == []
+    assert demux.feed("<bbb> one\n", now=5) == []
+    assert demux.feed("<aaa> two\n", now=9) == []
+    assert demux.expire(now=14) == []
+    assert demux.expire(now=15) == [("bbb", ["<bbb> one\n"])]
+    assert demux.feed("<ccc> one\n", now=30) == [("aaa", ["<aaa> one\n", "<aaa> two\n"])]
+    assert demux.flush() == [("ccc", ["<ccc> one\n"])]
+
+
+def test_memory_is_bounded():
+    demux = LogDemultiplexer(max_requests=2, max_lines_per_request=2, group_children=False)
+    assert demux.feed("[req:aaa] one\n", now=0) == []
+    assert demux.feed("[req:bbb] one\n", now=0) == []
+    assert demux.feed("[req:aaa.1] one\n", now=0) == [("aaa", ["[req:aaa] one\n"])]
+    assert demux.feed("[req:bbb] two\n", now=0) == [("bbb", ["[req:bbb] one\n", "[req:bbb] two\n"])]
+    assert demux.flush() == [("aaa.1", ["[req:aaa.1] one\n"])]
+
+
+def test_parameters_are_validated():
+    with raises(ValueError):
+        LogDemultiplexer(timeout=0)
+    with raises(ValueError):
+        LogDemultiplexer(max_requests=0)
+    with raises(ValueError):
+        LogDemultiplexer(prefix_format="[req] ")
+
+
+def test_command_line(tmp_path, capsys):
+    log_path = tmp_path / "app.log"
+    log_path.write_text("[req:aaa] one\n[req:bbb] one\n[req:aaa] two\n")
+    assert main([str(log_path)]) == 0
+    # at the end of the input, the least recently active request comes first
+    assert capsys.readouterr().out == "[req:bbb] one\n[req:aaa] one\n[req:aaa] two\n"
@@ -0,0 +1,138 @@
+import json
+import os
+
+from aiohttp_request_id_logging.log_index import LogIndex, main
+from aiohttp_request_id_logging.log_parsing import request_id_line_bytes_pattern
+
+
+def write_lines(path, *lines, mode="a"):
+    with open(path, mode) as f:
+        f.writelines(line + "\n" for line in lines)
+
+
+def test_request_id_line_bytes_pattern():
+    pattern = request_id_line_bytes_pattern()
+    m = pattern.search(b"2020-01-15 15:58:48,240  INFO: [req:kbyLG8d] Processing transfer id 1234")
+    assert m is not None
+    assert m.start() == 0
+    assert m.group("prefix_id") == b"kbyLG8d"
+    m = pattern.search(json.dumps({"message": "hello", "request_id": "abc.1"}).encode())
+    assert m is not None
+    assert m.group("json_id") == b"abc.1"
+    assert pattern.search(b"2020-01-15 15:58:48,240  INFO: Server started") is None
+    m = request_id_line_bytes_pattern("<{request_id}> ").search(b"INFO <xyz> hello")
+    assert m is not None
+    assert m.group("prefix_id") == b"xyz"
+
+
+def test_lookup_across_rotated_files(tmp_path):
+    log_path = tmp_path / "app.log"
+    write_lines(log_path, "INFO: [req:aaa] Processing GET /", "INFO: [req:bbb] Processing GET /", "INFO: Server started")
+    with LogIndex(tmp_path / "index.sqlite") as index:
+        assert index.update([log_path]) == 2
+        # logrotate: app.log -> app.log.1, new app.log
+        os.rename(log_path, tmp_path / "app.log.1")
+        os.utime(tmp_path / "app.log.1", (1, 1))
+        write_lines(log_path, "INFO: [req:aaa] Done", "INFO: [req:aaa.1] Child task")
+        assert index.update([tmp_path / "app.log.1", log_path]) == 2
+        assert [line for _, line in index.lookup("aaa")] == [
+            b"INFO: [req:aaa] Processing GET /",
+            b"INFO: [req:aaa] Done",
+            b"INFO: [req:aaa.1] Child task",
+        ]
+        assert [line for _, line in index.lookup("aaa", include_children=False)] == [b"INFO: [req:aaa] Processing GET /", b"INFO: [req:aaa] Done"]
+        assert [os.path.basename(path) for path, _ in index.lookup("bbb")] == ["app.log.1"]
+        assert list(index.lookup("aa")) == []
+
+
+def test_update_is_incremental(tmp_path):
+    log_path = tmp_path / "app.log"
+    write_lines(log_path, "INFO: [req:aaa] First")
+    with open(log_path, "a") as f:
+        f.write("INFO: [req:aaa] Incomplete")
+    with LogIndex(tmp_path / "index.sqlite") as index:
+        assert index.update([log_path]) == 1
+        assert index.update([log_path]) == 0
+        write_lines(log_path, " line", "INFO: [req:aaa] Third")
+        assert index.update([log_path]) == 2
+        assert [line for _, line in index.lookup("aaa")] == [b"INFO: [req:aaa] First", b"INFO: [req:aaa] Incomplete line", b"INFO: [req:aaa] Third"]
+        # copytruncate
+        write_lines(log_path, "INFO: [req:ccc] After truncation", mode="w")
+        assert index.update([log_path]) == 1
+        assert list(index.lookup("aaa")) == []
+        assert [line for _, line in index.lookup("ccc")] == [b"INFO: [req:ccc] After truncation"]
+
+
+def test_update_in_batches(tmp_path):
+    log_path = tmp_path / "app.log"
+    write_lines(log_path, *(f"INFO: [req:r{i}] line {i}" for i in range(10)), "INFO: no request id", "INFO: [req:r0] last")
+    with LogIndex(tmp_path / "index.sqlite") as index:
+        index.batch_size = 3
+        batches = list(index._scan(str(log_path), 0))
+        assert [len(entries) for _, entries in batches] == [3, 3, 3, 2]
+        # every batch ends at the start of the first line of the next one
+        assert batches[1][1][0][1] == batches[0][0]
+        assert batches[-1][0] == os.path.getsize(log_path)
+        assert index.update([log_path]) == 11
+        assert [line for _, line in index.lookup("r0")] == [b"INFO: [req:r0] line 0", b"INFO: [req:r0] last"]
+        assert index.update([log_path]) == 0
+
+
+def test_removed_files_are_dropped_from_index(tmp_path):
+    write_lines(tmp_path / "app.log.1", "INFO: [req:aaa] Old")
+    write_lines(tmp_path / "app.log", "INFO: [req:aaa] New")
+    with LogIndex(tmp_path / "index.sqlite") as index:
+        index.update([tmp_path / "app.log.1", tmp_path / "app.log"])
+        os.unlink(tmp_path / "app.log.1")
+        index.update([tmp_path / "app.log"])
+        assert index._db.execute("SELECT count(*) FROM files").fetchone() == (1,)
+        assert [line for _, line in index.lookup("aaa")] == [b"INFO: [req:aaa] New"]
+
+
+def test_command_line(tmp_path, capsys):
+    log_path = tmp_path / "app.log"
+    write_lines(log_path, json.dumps({"message": "hello", "request_id": "abc"}), json.dumps({"message": "other", "request_id": "xyz"}))
+    index_path = str(tmp_path / "index.sqlite")
+    assert main(["--index", index_path, "build", str(log_path)]) == 0
+    assert capsys.readouterr().err == "Indexed 2 new lines\n"
+    assert main(["--index", index_path, "lookup", "abc"]) == 0
+    assert capsys.readouterr().out == '{"message": "hello", "request_id": "abc"}\n'
+    assert main(["--index", index_path, "lookup", "nonexistent"]) == 1
+
+
+def test_continuation_lines_are_indexed(tmp_path):
+    log_path = tmp_path / "app.log"
+    write_lines(
+        log_path,
+        "ERROR: [req:aaa] Error handling request",
+        "Traceback (most recent call last):",
+        '  File "app.py", line 1, in handler',
+        "ValueError: boom",
+        "INFO: Server started",
+        "  indented line after a line without request id",
+        "INFO: [req:bbb] Details:",
+    )
+    with LogIndex(tmp_path / "index.sqlite") as index:
+        assert index.update([log_path]) == 5
+        # continuation lines appended later belong to the last line before them
+        write_lines(log_path, "  first detail", "", "  second detail", "INFO: Server stopping")
+        assert index.update([log_path]) == 3
+        assert [line for _, line in index.lookup("aaa")] == [
+            b"ERROR: [req:aaa] Error handling request",
+            b"Traceback (most recent call last):",
+            b'  File "app.py", line 1, in handler',
+            b"ValueError: boom",
+        ]
+        assert [line for _, line in index.lookup("bbb")] == [b"INFO: [req:bbb] Details:", b"  first detail", b"", b"  second detail"]
+
+
+def test_lookup_skips_truncated_files(tmp_path):
+    log_path = tmp_path / "app.log"
+    write_lines(log_path, "INFO: [req:aaa] First", "INFO: [req:aaa] Second")
+    with LogIndex(tmp_path / "index.sqlite") as index:
+        index.update([log_path])
+        write_lines(log_path, "INFO: [req:aaa] New", mode="w")
+        # the offset of the second line is past the end of the file now
+        assert len(list(index.lookup("aaa"))) == 1
+        write_lines(log_path, mode="w")
+        assert list(index.lookup("aaa")) == []
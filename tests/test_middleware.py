@@ -1,13 +1,18 @@
-from asyncio import run
+from asyncio import CancelledError, create_task, run, sleep
+from functools import partial, update_wrapper
 from aiohttp import web
 from aiohttp.test_utils import make_mocked_request, TestClient, TestServer
-from logging import INFO
-from pytest import raises
+from logging import INFO, getLogger
+from pytest import raises, warns
+import re
 import warnings
 
 from aiohttp_request_id_logging import (
+    CancelledRequestStats,
     request_id_middleware,
     request_id,
+    setup_logging_request_id_prefix,
+    RequestIdAccessLogger,
     RequestIdKeyAlreadySetError,
     RequestIdMiddleware,
     REQUEST_ID_KEY,
@@ -20,6 +25,16 @@ async def hello(request):
     return web.Response(text="Hello, world!\n")
 
 
+async def make_routed_request(app, method, path):
+    # make_mocked_request does not do the routing - its match_info
+    # contains a mock route
+    request = make_mocked_request(method, path, app=app)
+    match_info = await app.router.resolve(request)
+    match_info.add_app(app)
+    request._match_info = match_info
+    return request
+
+
 def test_middleware_sets_request_id():
     middleware = request_id_middleware()
     request = make_mocked_request("GET", "/")
@@ -48,6 +63,21 @@ def test_middleware_no_fallback_request_id_key():
             assert "request_id" not in request
 
 
+def test_middleware_fallback_request_id_key_triggers_no_warning(monkeypatch):
+    # aiohttp warns about every plain string key only once per process
+    monkeypatch.setattr(web.BaseRequest, "_seen_str_keys", set(), raising=False)
+    with warnings.catch_warnings():
+        # nothing the middleware does when created may be needed later
+        middleware = RequestIdMiddleware()
+    request = make_mocked_request("GET", "/")
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        response = run(middleware(request, hello))
+    assert response.status == 200
+    assert request[REQUEST_ID_KEY]
+    assert request._state["request_id"] == request[REQUEST_ID_KEY]
+
+
 def test_middleware_logs_request_start_by_default(caplog):
     middleware = request_id_middleware()
     request = make_mocked_request("GET", "/")
@@ -288,3 +318,416 @@ def test_middleware_raises_when_legacy_string_key_already_set():
         request["request_id"] = "alreadyset"
     with raises(RequestIdKeyAlreadySetError):
         run(middleware(request, hello))
+
+
+def test_middleware_logs_cancelled_request(caplog):
+    middleware = RequestIdMiddleware()
+
+    async def slow_handler(request):
+        await sleep(3600)
+
+    async def scenario():
+        task = create_task(middleware(make_mocked_request("GET", "/"), slow_handler))
+        await sleep(0.01)
+        task.cancel()
+        with raises(CancelledError):
+            await task
+
+    with caplog.at_level(INFO, logger="aiohttp_request_id_logging"):
+        run(scenario())
+    assert any(r.message.startswith("(Cancelled after 0.0") for r in caplog.records)
+    # no metrics collected by default
+    assert middleware.metrics_snapshot() == {}
+
+
+def test_middleware_tracks_cancelled_requests():
+    middleware = RequestIdMiddleware(track_cancelled_requests=True)
+
+    async def slow_handler(request):
+        sum(range(100_000))
+        await sleep(3600)
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_get("/users/{user_id}", slow_handler)
+        for path in ["/users/1", "/users/2"]:
+            request = await make_routed_request(app, "GET", path)
+            task = create_task(middleware(request, slow_handler))
+            await sleep(0.01)
+            task.cancel()
+            with raises(CancelledError):
+                await task
+        # the successful requests are not counted
+        await middleware(make_mocked_request("GET", "/"), hello)
+
+    run(scenario())
+    snapshot = middleware.metrics_snapshot()
+    (route,) = snapshot["cancelled_requests"].keys()
+    assert route == "GET /users/{user_id}"
+    counters = snapshot["cancelled_requests"][route]
+    assert counters["count"] == 2
+    assert counters["wall_time"] >= 0.02
+    assert 0 < counters["cpu_time"] < counters["wall_time"]
+
+
+def test_middleware_cancelled_request_routes_are_bounded():
+    middleware = RequestIdMiddleware(track_cancelled_requests=True)
+
+    async def slow_handler(request):
+        await sleep(3600)
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_route("*", "/any", slow_handler)
+        requests = [await make_routed_request(app, method, "/any") for method in ["GET", "METHOD1", "METHOD2"]]
+        # unmatched, with a client-chosen method
+        requests.append(make_mocked_request("METHOD3", "/nonexistent"))
+        for request in requests:
+            task = create_task(middleware(request, slow_handler))
+            await sleep(0)
+            task.cancel()
+            with raises(CancelledError):
+                await task
+
+    run(scenario())
+    snapshot = middleware.metrics_snapshot()["cancelled_requests"]
+    assert {route: counters["count"] for route, counters in snapshot.items()} == {
+        "GET /any": 1,
+        "OTHER /any": 2,
+        "OTHER (unmatched)": 1,
+    }
+
+
+def test_cancelled_request_stats_max_routes():
+    stats = CancelledRequestStats(max_routes=2)
+    for route in ["GET /a", "GET /b", "GET /c", "GET /a", "GET /d"]:
+        stats.record(route, 1.0, 0.5)
+    assert {route: counters["count"] for route, counters in stats.snapshot().items()} == {
+        "GET /a": 2,
+        "GET /b": 1,
+        CancelledRequestStats.OVERFLOW_ROUTE: 2,
+    }
+    with raises(ValueError):
+        CancelledRequestStats(max_routes=0)
+
+
+def test_middleware_logs_resource_usage(caplog):
+    middleware = RequestIdMiddleware(log_resource_usage=True, allocation_accounting="blocks")
+
+    async def computing_handler(request):
+        await sleep(0)
+        data = [str(i) for i in range(10_000)]
+        return web.Response(text=data[-1])
+
+    request = make_mocked_request("GET", "/")
+    with caplog.at_level(INFO, logger="aiohttp_request_id_logging"):
+        response = run(middleware(request, computing_handler))
+    assert response.status == 200
+    (message,) = [r.message for r in caplog.records if r.message.startswith("Resource usage")]
+    assert re.fullmatch(r"Resource usage: CPU \d+\.\d ms, allocated -?\d+ blocks", message)
+
+
+def test_middleware_resource_usage_parameters_are_validated():
+    with raises(TypeError):
+        RequestIdMiddleware(log_resource_usage="yes")  # ty: ignore[invalid-argument-type]
+    with raises(ValueError, match="allocation_accounting"):
+        RequestIdMiddleware(allocation_accounting="bytes")
+    with raises(ValueError, match="requires log_resource_usage"):
+        RequestIdMiddleware(allocation_accounting="blocks", track_cancelled_requests=True)
+    with warns(UserWarning, match="tracemalloc"):
+        RequestIdMiddleware(log_resource_usage=True, allocation_accounting="tracemalloc")
+
+
+class Views:
+    async def get(self, request):
+        return web.Response(text="ok")
+
+
+class CallableHandler:
+    async def __call__(self, request):
+        return web.Response(text="ok")
+
+
+class SlottedCallableHandler:
+    # no __weakref__ slot - cannot be weakly referenced
+    __slots__ = ()
+
+    async def __call__(self, request):
+        return web.Response(text="ok")
+
+
+def test_get_function_name():
+    get_function_name = RequestIdMiddleware.get_function_name
+    assert get_function_name(hello) == f"{__name__}:hello"
+    assert get_function_name(Views().get) == f"{__name__}:Views.get"
+    assert get_function_name(CallableHandler()) == f"{__name__}:CallableHandler"
+    assert get_function_name(web.View) == "aiohttp.web_urldispatcher:View"
+    assert get_function_name(partial(partial(hello))) == f"{__name__}:hello"
+    # aiohttp wraps the handler in a partial with the handler metadata copied
+    # when there are more middlewares - the metadata wins over partial.func
+    assert get_function_name(update_wrapper(partial(hello), Views().get)) == f"{__name__}:get"
+
+
+def test_middleware_caches_function_names(caplog):
+    calls = []
+
+    class CountingMiddleware(RequestIdMiddleware):
+        @staticmethod
+        def get_function_name(f):
+            calls.append(f)
+            return RequestIdMiddleware.get_function_name(f)
+
+    middleware = CountingMiddleware()
+    with caplog.at_level(INFO, logger="aiohttp_request_id_logging"):
+        for _ in range(3):
+            run(middleware(make_mocked_request("GET", "/"), hello))
+        # a handler that cannot be weakly referenced still works, uncached
+        slotted_handler = SlottedCallableHandler()
+        for _ in range(2):
+            run(middleware(make_mocked_request("GET", "/"), slotted_handler))
+    assert calls == [hello, slotted_handler, slotted_handler]
+    messages = [r.message for r in caplog.records if r.message.startswith("Processing")]
+    assert messages == [f"Processing GET / ({__name__}:hello)"] * 3 + [f"Processing GET / ({__name__}:SlottedCallableHandler)"] * 2
+
+
+def test_middleware_logs_route_template(caplog):
+    middleware = RequestIdMiddleware(log_route_template=True)
+
+    async def get_user(request):
+        return web.Response(text="ok")
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_get("/users/{user_id}", get_user)
+        for path in ["/users/1", "/users/2"]:
+            await middleware(await make_routed_request(app, "GET", path), get_user)
+        # no route matched - logged with the path
+        await middleware(make_mocked_request("GET", "/nonexistent"), hello)
+
+    with caplog.at_level(INFO, logger="aiohttp_request_id_logging"):
+        run(scenario())
+    messages = [r.message for r in caplog.records if r.message.startswith("Processing")]
+    assert messages == [
+        f"Processing GET /users/{{user_id}} ({__name__}:get_user)",
+        f"Processing GET /users/{{user_id}} ({__name__}:get_user)",
+        f"Processing GET /nonexistent ({__name__}:hello)",
+    ]
+    # the message is built once per route
+    assert len(middleware._route_start_messages) == 1
+
+
+def test_middleware_route_template_cache_does_not_grow_with_methods(caplog):
+    middleware = RequestIdMiddleware(log_route_template=True)
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_route("*", "/any/{name}", hello)
+        for i in range(20):
+            await middleware(await make_routed_request(app, f"METHOD{i}", f"/any/{i}"), hello)
+
+    with caplog.at_level(INFO, logger="aiohttp_request_id_logging"):
+        run(scenario())
+    messages = [r.message for r in caplog.records if r.message.startswith("Processing")]
+    assert messages[:2] == [f"Processing METHOD0 /any/{{name}} ({__name__}:hello)", f"Processing METHOD1 /any/{{name}} ({__name__}:hello)"]
+    # the method chosen by the client is not a part of the cache key
+    assert len(middleware._route_start_messages) == 1
+
+
+def test_middleware_logs_route_template_without_function_name(caplog):
+    middleware = RequestIdMiddleware(log_route_template=True, log_function_name=False)
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_get("/users/{user_id}", hello)
+        await middleware(await make_routed_request(app, "GET", "/users/1"), hello)
+
+    with caplog.at_level(INFO, logger="aiohttp_request_id_logging"):
+        run(scenario())
+    assert "Processing GET /users/{user_id}" in [r.message for r in caplog.records]
+
+
+def run_deferred_request_start_scenario(handler, caplog, request_start_delay=0.05, **middleware_kwargs):
+    setup_logging_request_id_prefix()
+    middleware = RequestIdMiddleware(request_start_delay=request_start_delay, **middleware_kwargs)
+
+    async def scenario():
+        app = web.Application(middlewares=[middleware])
+        app.router.add_get("/", handler)
+        server = TestServer(app)
+        await server.start_server(access_log_class=RequestIdAccessLogger)
+        async with TestClient(server) as client:
+            response = await client.get("/")
+            assert response.status == 200
+            return response.headers["X-Request-Id"]
+
+    with caplog.at_level(INFO):
+        req_id = run(scenario())
+    return [(r.message, getattr(r, "request_id", None)) for r in caplog.records if r.name != "asyncio"], req_id
+
+
+def test_middleware_deferred_request_start_is_folded_into_access_log(caplog):
+    async def fast_handler(request):
+        return web.Response(text="ok")
+
+    records, req_id = run_deferred_request_start_scenario(fast_handler, caplog)
+    assert not any(message.startswith("Processing") for message, _ in records)
+    (access_line,) = [(message, rid) for message, rid in records if '"GET / HTTP/1.1" 200' in message]
+    assert access_line[0].endswith(f" ({__name__}:fast_handler)")
+    assert access_line[1] == req_id
+
+
+def test_middleware_resource_usage_is_folded_into_access_log(caplog):
+    async def fast_handler(request):
+        return web.Response(text="ok")
+
+    records, req_id = run_deferred_request_start_scenario(fast_handler, caplog, log_resource_usage=True)
+    messages = [message for message, rid in records if rid == req_id]
+    assert len(messages) == 1
+    assert re.search(rf" \({__name__}:fast_handler, Resource usage: CPU \d+\.\d ms\)$", messages[0])
+
+
+def test_middleware_resource_usage_is_logged_after_deferred_request_start(caplog):
+    async def logging_handler(request):
+        getLogger(__name__).info("Doing something")
+        return web.Response(text="ok")
+
+    records, req_id = run_deferred_request_start_scenario(logging_handler, caplog, log_resource_usage=True)
+    messages = [message for message, rid in records if rid == req_id]
+    assert messages[0] == f"Processing GET / ({__name__}:logging_handler)"
+    assert messages[2].startswith("Resource usage: CPU")
+    assert '"GET / HTTP/1.1" 200' in messages[3]
+    assert not messages[3].endswith(")")
+
+
+def test_middleware_deferred_request_start_is_logged_before_other_messages(caplog):
+    async def logging_handler(request):
+        getLogger(__name__).info("Doing something")
+        return web.Response(text="ok")
+
+    records, req_id = run_deferred_request_start_scenario(logging_handler, caplog)
+    messages = [message for message, rid in records if rid == req_id]
+    assert messages[0] == f"Processing GET / ({__name__}:logging_handler)"
+    assert messages[1] == "Doing something"
+    # the access log line is not extended - the start message was logged
+    assert '"GET / HTTP/1.1" 200' in messages[2]
+    assert not messages[2].endswith("logging_handler)")
+    assert len(messages) == 3
+
+
+def test_middleware_deferred_request_start_is_logged_for_slow_requests(caplog):
+    async def slow_handler(request):
+        await sleep(0.05)
+        return web.Response(text="ok")
+
+    records, req_id = run_deferred_request_start_scenario(slow_handler, caplog, request_start_delay=0.01)
+    messages = [message for message, rid in records if rid == req_id]
+    assert messages[0] == f"Processing GET / ({__name__}:slow_handler)"
+    assert len(messages) == 2
+    assert not messages[1].endswith("slow_handler)")
+
+
+def test_middleware_request_start_delay_is_validated():
+    with raises(TypeError):
+        RequestIdMiddleware(request_start_delay="1")  # ty: ignore[invalid-argument-type]
+    with raises(ValueError):
+        RequestIdMiddleware(request_start_delay=-1)
+
+
+def test_middleware_stack_callbacks_run_within_request_id_context():
+    calls = []
+
+    class MyMiddleware(RequestIdMiddleware):
+        async def before_request(self, request, handler, req_id, stack):
+            await super().before_request(request, handler, req_id, stack)
+            stack.callback(lambda: calls.append(("first registered", request_id.get())))
+            stack.callback(lambda: calls.append(("second registered", request_id.get())))
+
+    middleware = MyMiddleware(request_id_factory=lambda: "abc1234")
+    response = run(middleware(make_mocked_request("GET", "/"), hello))
+    assert response.status == 200
+    assert calls == [("second registered", "abc1234"), ("first registered", "abc1234")]
+    assert request_id.get() is None
+
+
+def test_middleware_stack_pop_all_in_hook():
+    calls = []
+    popped_stacks = []
+
+    class MyMiddleware(RequestIdMiddleware):
+        async def before_request(self, request, handler, req_id, stack):
+            await super().before_request(request, handler, req_id, stack)
+            stack.callback(lambda: calls.append("moved"))
+            # move the cleanup registered so far out of the request
+            popped_stacks.append(stack.pop_all())
+            stack.callback(lambda: calls.append(("stayed", request_id.get())))
+
+    middleware = MyMiddleware(request_id_factory=lambda: "abc1234")
+    response = run(middleware(make_mocked_request("GET", "/"), hello))
+    assert response.status == 200
+    assert calls == [("stayed", "abc1234")]
+    assert request_id.get() is None
+    [popped] = popped_stacks
+    popped.close()
+    assert calls == [("stayed", "abc1234"), "moved"]
+
+
+def test_middleware_adds_header_on_response_prepare():
+    async def stream_handler(request):
+        response = web.StreamResponse()
+        await response.prepare(request)
+        await response.write(b"data: hello\n\n")
+        return response
+
+    async def forbidden_handler(request):
+        raise web.HTTPForbidden()
+
+    async def scenario(middleware):
+        app = web.Application(middlewares=[middleware])
+        middleware.setup_response_prepare_header(app)
+        app.router.add_get("/", hello)
+        app.router.add_get("/stream", stream_handler)
+        app.router.add_get("/forbidden", forbidden_handler)
+        headers = []
+        async with TestClient(TestServer(app)) as client:
+            for path in ["/", "/stream", "/forbidden", "/nonexistent"]:
+                async with client.get(path) as resp:
+                    await resp.read()
+                    headers.append(resp.headers.getall("X-Request-Id", []))
+        return headers
+
+    middleware = RequestIdMiddleware(request_id_factory=lambda: "abc1234")
+    assert run(scenario(middleware)) == [["abc1234"]] * 4
+
+    def add_header(response, req_id):
+        response.headers["X-Trace"] = req_id
+
+    middleware = RequestIdMiddleware(request_id_factory=lambda: "abc1234", add_response_request_id_header=add_header)
+    assert run(scenario(middleware)) == [[]] * 4
+
+
+def test_middleware_reentrant_in_sub_application(caplog):
+    seen_request_ids = []
+
+    async def handler(request):
+        seen_request_ids.append((request[REQUEST_ID_KEY], request_id.get()))
+        return web.Response(text="ok")
+
+    async def scenario():
+        app = web.Application(middlewares=[RequestIdMiddleware(reentrant=True)])
+        sub_app = web.Application(middlewares=[RequestIdMiddleware(reentrant=True)])
+        sub_app.router.add_get("/hello", handler)
+        app.add_subapp("/sub", sub_app)
+        async with TestClient(TestServer(app)) as client:
+            response = await client.get("/sub/hello")
+            assert response.status == 200
+            return response.headers["X-Request-Id"]
+
+    with caplog.at_level(INFO, logger="aiohttp_request_id_logging"):
+        req_id = run(scenario())
+    assert seen_request_ids == [(req_id, req_id)]
+    assert [r.message for r in caplog.records if r.message.startswith("Processing")] == [f"Processing GET /sub/hello ({__name__}:handler)"]
+
+
+def test_middleware_reentrant_must_be_bool():
+    with raises(TypeError):
+        RequestIdMiddleware(reentrant="yes")  # ty: ignore[invalid-argument-type]
@@ -0,0 +1,63 @@
+from asyncio import run, sleep
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+from logging import WARNING
+from pytest import raises
+import time
+
+from aiohttp_request_id_logging import RequestIdMiddleware, RequestProfiler
+
+
+async def busy_handler(request):
+    await sleep(0)
+    deadline = time.monotonic() + 0.1
+    while time.monotonic() < deadline:
+        pass
+    return web.Response(text="ok")
+
+
+def test_profiler_writes_collapsed_stack_file(tmp_path):
+    profiler = RequestProfiler(tmp_path, sample_rate=1.0, interval=0.001)
+    middleware = RequestIdMiddleware(profiler=profiler, request_id_factory=lambda: "abc1234")
+    response = run(middleware(make_mocked_request("GET", "/"), busy_handler))
+    assert response.status == 200
+    lines = (tmp_path / "abc1234.collapsed").read_text().splitlines()
+    assert lines
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0
+    assert any(line.split(" ")[0].endswith("test_profiling:busy_handler") for line in lines)
+
+
+def test_profiler_skips_unselected_requests(tmp_path):
+    profiler = RequestProfiler(tmp_path, header_name="X-Profile")
+    middleware = RequestIdMiddleware(profiler=profiler, request_id_factory=iter(["first", "second"]).__next__)
+    run(middleware(make_mocked_request("GET", "/"), busy_handler))
+    run(middleware(make_mocked_request("GET", "/", headers={"X-Profile": "1"}), busy_handler))
+    assert [p.name for p in tmp_path.iterdir()] == ["second.collapsed"]
+
+
+def test_profiler_sanitizes_file_name(tmp_path):
+    profiler = RequestProfiler(tmp_path, sample_rate=1.0)
+    middleware = RequestIdMiddleware(profiler=profiler, request_id_factory=lambda: "../x/y")
+    run(middleware(make_mocked_request("GET", "/"), busy_handler))
+    assert [p.name for p in tmp_path.iterdir()] == [".._x_y.collapsed"]
+
+
+def test_profiler_parameters_are_validated(tmp_path):
+    with raises(ValueError):
+        RequestProfiler(tmp_path, sample_rate=2)
+    with raises(ValueError):
+        RequestProfiler(tmp_path, interval=0)
+    with raises(TypeError):
+        RequestIdMiddleware(profiler=tmp_path)
+
+
+def test_profiler_write_error_is_logged(tmp_path, caplog):
+    (tmp_path / "file").write_text("")
+    profiler = RequestProfiler(tmp_path / "file", sample_rate=1.0)
+    middleware = RequestIdMiddleware(profiler=profiler, request_id_factory=lambda: "abc1234")
+    with caplog.at_level(WARNING, logger="aiohttp_request_id_logging.profiling"):
+        response = run(middleware(make_mocked_request("GET", "/"), busy_handler))
+    assert response.status == 200
+    assert "Could not write request profile" in caplog.text
@@ -1,6 +1,140 @@
+import os
+from pytest import mark, raises, warns
+import subprocess
+import sys
+from threading import Barrier, Thread
+import time
+import warnings
+
 import aiohttp_request_id_logging
 
 
 def test_generate_request_id():
     assert len(aiohttp_request_id_logging.generate_request_id()) == 7
     assert len(aiohttp_request_id_logging.generate_request_id(9)) == 9
+
+
+def decode_base62(s):
+    n = 0
+    for c in s:
+        n = n * 62 + "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz".index(c)
+    return n
+
+
+def test_snowflake_request_ids_are_sortable_and_unique():
+    factory = aiohttp_request_id_logging.SnowflakeRequestIdFactory(worker_id=5)
+    ids = [factory() for _ in range(10000)]
+    assert all(len(req_id) == 11 for req_id in ids)
+    assert sorted(ids) == ids
+    assert len(set(ids)) == len(ids)
+    assert all((decode_base62(req_id) >> 12) & 1023 == 5 for req_id in ids)
+    assert [decode_base62(req_id) for req_id in ids] == sorted(decode_base62(req_id) for req_id in ids)
+
+
+def test_snowflake_request_id_for_time():
+    factory = aiohttp_request_id_logging.SnowflakeRequestIdFactory(worker_id=1)
+    before = aiohttp_request_id_logging.SnowflakeRequestIdFactory.request_id_for_time(time.time())
+    req_id = factory()
+    after = aiohttp_request_id_logging.SnowflakeRequestIdFactory.request_id_for_time(time.time() + 0.01)
+    assert before <= req_id < after
+
+
+def test_snowflake_worker_id_from_environment(monkeypatch):
+    monkeypatch.setenv("REQUEST_ID_WORKER_ID", "1023")
+    req_id = aiohttp_request_id_logging.SnowflakeRequestIdFactory()()
+    assert (decode_base62(req_id) >> 12) & 1023 == 1023
+    # an invalid value is reported when the factory is created
+    for invalid in ["1024", "abc"]:
+        monkeypatch.setenv("REQUEST_ID_WORKER_ID", invalid)
+        with raises(ValueError, match="REQUEST_ID_WORKER_ID|worker_id must be"):
+            aiohttp_request_id_logging.SnowflakeRequestIdFactory()
+    with raises(ValueError):
+        aiohttp_request_id_logging.SnowflakeRequestIdFactory(worker_id=-1)
+    # the variable is read again on the first call
+    monkeypatch.delenv("REQUEST_ID_WORKER_ID")
+    factory = aiohttp_request_id_logging.SnowflakeRequestIdFactory()
+    monkeypatch.setenv("REQUEST_ID_WORKER_ID", "7")
+    assert (decode_base62(factory()) >> 12) & 1023 == 7
+
+
+def test_invalid_worker_id_environment_variable_does_not_break_import():
+    env = dict(os.environ, REQUEST_ID_WORKER_ID="web-3")
+    code = "import aiohttp_request_id_logging as m\ntry:\n    m.snowflake_request_id_factory()\nexcept ValueError as e:\n    print(e)"
+    result = subprocess.run([sys.executable, "-W", "error", "-c", code], env=env, capture_output=True, text=True, check=True)
+    assert result.stdout == "REQUEST_ID_WORKER_ID must be an integer, not 'web-3'\n"
+
+
+def test_snowflake_default_instance_does_not_warn(monkeypatch):
+    monkeypatch.delenv("REQUEST_ID_WORKER_ID", raising=False)
+    factory = aiohttp_request_id_logging.SnowflakeRequestIdFactory._create_default()
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        assert len(factory()) == 11
+
+
+def test_snowflake_random_worker_id_warns(monkeypatch):
+    monkeypatch.delenv("REQUEST_ID_WORKER_ID", raising=False)
+    factory = aiohttp_request_id_logging.SnowflakeRequestIdFactory()
+    with warns(RuntimeWarning, match="random"):
+        ids = [factory(), factory()]
+    worker_ids = {(decode_base62(req_id) >> 12) & 1023 for req_id in ids}
+    assert len(worker_ids) == 1
+
+
+def test_ulid_request_ids_are_sortable_and_unique():
+    factory = aiohttp_request_id_logging.UlidRequestIdFactory()
+    before_ms = time.time_ns() // 1_000_000
+    ids = [factory() for _ in range(10000)]
+    assert all(len(req_id) == 26 and set(req_id) <= set("0123456789ABCDEFGHJKMNPQRSTVWXYZ") for req_id in ids)
+    assert sorted(ids) == ids
+    assert len(set(ids)) == len(ids)
+    # the first 10 characters are the millisecond timestamp
+    timestamp_ms = int(ids[0][:10].translate(str.maketrans("ABCDEFGHJKMNPQRSTVWXYZ", "abcdefghijklmnopqrstuv")), 32)
+    assert before_ms <= timestamp_ms <= time.time_ns() // 1_000_000
+
+
+def test_ulid_encoding():
+    from aiohttp_request_id_logging.request_id_factories import _encode_ulid
+
+    # example from the ULID specification
+    assert _encode_ulid(1469918176385, 0) == "01ARYZ6S410000000000000000"
+    assert _encode_ulid(2**48 - 1, 2**80 - 1) == "7ZZZZZZZZZZZZZZZZZZZZZZZZZ"
+
+
+@mark.parametrize(
+    "factory_class",
+    [
+        aiohttp_request_id_logging.SequentialRequestIdFactory,
+        aiohttp_request_id_logging.SnowflakeRequestIdFactory,
+        aiohttp_request_id_logging.UlidRequestIdFactory,
+    ],
+)
+def test_factories_are_thread_safe(factory_class, monkeypatch):
+    monkeypatch.setenv("REQUEST_ID_WORKER_ID", "3")
+    factory = factory_class()
+    thread_count = 8
+    barrier = Barrier(thread_count)
+    results = []
+
+    def generate():
+        barrier.wait()
+        results.append([factory() for _ in range(5000)])
+
+    threads = [Thread(target=generate) for _ in range(thread_count)]
+    # make the threads switch often, so that a race would show up
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+    all_ids = [req_id for ids in results for req_id in ids]
+    assert len(all_ids) == thread_count * 5000
+    assert len(set(all_ids)) == len(all_ids)
+    for ids in results:
+        # every thread gets its ids in order
+        if factory_class is not aiohttp_request_id_logging.SequentialRequestIdFactory:
+            assert sorted(ids) == ids
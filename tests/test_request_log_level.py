@@ -0,0 +1,145 @@
+from asyncio import run
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+import logging
+from logging import DEBUG, INFO, Handler, getLogger
+from pytest import fixture, raises
+
+from aiohttp_request_id_logging import (
+    RequestIdMiddleware,
+    request_log_level,
+    setup_logging_request_id_prefix,
+    setup_request_log_level,
+)
+
+
+logger = getLogger(__name__)
+
+
+class ListHandler(Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@fixture
+def handler():
+    uninstall = setup_request_log_level()
+    handler = ListHandler()
+    logger.addHandler(handler)
+    logger.setLevel(INFO)
+    try:
+        yield handler
+    finally:
+        logger.removeHandler(handler)
+        logger.setLevel(logging.NOTSET)
+        uninstall()
+
+
+async def hello(request):
+    logger.debug("Debug details: %s", request.path)
+    logger.info("Info message")
+    return web.Response(text="Hello, world!\n")
+
+
+def get_debug_header_log_level(request):
+    return DEBUG if request.headers.get("X-Debug-Log") == "secret" else None
+
+
+def test_request_log_level_enables_debug_records_only_for_flagged_requests(handler):
+    middleware = RequestIdMiddleware(get_request_log_level=get_debug_header_log_level)
+    run(middleware(make_mocked_request("GET", "/plain"), hello))
+    run(middleware(make_mocked_request("GET", "/flagged", headers={"X-Debug-Log": "secret"}), hello))
+    run(middleware(make_mocked_request("GET", "/wrong", headers={"X-Debug-Log": "guess"}), hello))
+    assert [r.getMessage() for r in handler.records] == [
+        "Info message",
+        "Debug details: /flagged",
+        "Info message",
+        "Info message",
+    ]
+    assert request_log_level.get() is None
+    assert not logger.isEnabledFor(DEBUG)
+
+
+def test_request_log_level_does_not_create_records_in_other_requests(handler):
+    created = []
+    original_factory = logging.getLogRecordFactory()
+
+    def counting_factory(*args, **kwargs):
+        record = original_factory(*args, **kwargs)
+        created.append(record.levelno)
+        return record
+
+    logging.setLogRecordFactory(counting_factory)
+    try:
+        middleware = RequestIdMiddleware(get_request_log_level=get_debug_header_log_level, log_request_start=lambda request, handler: None)
+        run(middleware(make_mocked_request("GET", "/plain"), hello))
+    finally:
+        logging.setLogRecordFactory(original_factory)
+    assert created == [INFO]
+
+
+def test_request_log_level_keeps_deferred_request_start_deferred(handler, caplog):
+    setup_logging_request_id_prefix()
+    middleware = RequestIdMiddleware(get_request_log_level=get_debug_header_log_level, request_start_delay=10)
+
+    async def debug_only(request):
+        logger.debug("Debug details")
+        return web.Response(text="ok")
+
+    with caplog.at_level(INFO, logger="aiohttp_request_id_logging"):
+        run(middleware(make_mocked_request("GET", "/plain"), debug_only))
+    assert not [r for r in caplog.records if r.getMessage().startswith("Processing")]
+    assert handler.records == []
+
+
+def test_request_log_level_respects_logging_disable(handler):
+    token = request_log_level.set(DEBUG)
+    logging.disable(INFO)
+    try:
+        assert not logger.isEnabledFor(DEBUG)
+    finally:
+        logging.disable(logging.NOTSET)
+    try:
+        assert logger.isEnabledFor(DEBUG)
+    finally:
+        request_log_level.reset(token)
+    assert not logger.isEnabledFor(DEBUG)
+
+
+def test_request_log_level_from_overridden_method(handler):
+    class DebugMiddleware(RequestIdMiddleware):
+        def get_request_log_level(self, request):
+            return get_debug_header_log_level(request)
+
+    middleware = DebugMiddleware()
+    run(middleware(make_mocked_request("GET", "/flagged", headers={"X-Debug-Log": "secret"}), hello))
+    assert [r.levelno for r in handler.records] == [DEBUG, INFO]
+
+
+def test_get_request_log_level_must_be_callable():
+    with raises(TypeError):
+        RequestIdMiddleware(get_request_log_level=DEBUG)  # ty: ignore[invalid-argument-type]
+
+
+def test_setup_request_log_level_can_be_uninstalled():
+    original_is_enabled_for = logging.Logger.isEnabledFor
+    uninstall = setup_request_log_level()
+    assert setup_request_log_level() is uninstall
+    assert logging.Logger.isEnabledFor is not original_is_enabled_for
+    token = request_log_level.set(DEBUG)
+    try:
+        logger.setLevel(INFO)
+        assert logger.isEnabledFor(DEBUG)
+        uninstall()
+        assert logging.Logger.isEnabledFor is original_is_enabled_for
+        assert not logger.isEnabledFor(DEBUG)
+    finally:
+        request_log_level.reset(token)
+        logger.setLevel(logging.NOTSET)
+    # can be set up again
+    setup_request_log_level()()
+    assert logging.Logger.isEnabledFor is original_is_enabled_for
@@ -4,9 +4,19 @@ from types import SimpleNamespace
 from aiohttp import web
 from aiohttp.test_utils import make_mocked_request
 from pytest import warns
+import pytest
+import subprocess
+import sys
 
 import aiohttp_request_id_logging
-from aiohttp_request_id_logging import RequestIdMiddleware, REQUEST_ID_KEY
+from aiohttp_request_id_logging import (
+    RequestIdMiddleware,
+    REQUEST_ID_KEY,
+    add_request_id_to_sentry_breadcrumb,
+    add_request_id_to_sentry_event,
+    request_id,
+    set_sentry_scope_enabled,
+)
 
 
 async def hello(request):
@@ -86,3 +96,129 @@ def test_sentry_sdk_without_scope_functions_warns(monkeypatch):
     with warns(UserWarning, match="isolation_scope or push_scope"):
         middleware = RequestIdMiddleware()
     assert middleware.sentry_make_scope is None
+
+
+def test_lazy_sentry_scope_installs_event_processor(monkeypatch):
+    created_scopes = []
+    event_processors = []
+    global_scope = SimpleNamespace(add_event_processor=event_processors.append)
+    fake_sentry = SimpleNamespace(isolation_scope=make_fake_scope_cm(created_scopes), get_global_scope=lambda: global_scope)
+    monkeypatch.setattr(aiohttp_request_id_logging, "sentry_sdk", fake_sentry)
+    middleware = RequestIdMiddleware(lazy_sentry_scope=True)
+    RequestIdMiddleware(lazy_sentry_scope=True)
+    # installed only once
+    assert event_processors == [add_request_id_to_sentry_event]
+    assert middleware.sentry_make_scope is None
+    request = make_mocked_request("GET", "/")
+    response = run(middleware(request, hello))
+    assert response.status == 200
+    # no per-request scope
+    assert created_scopes == []
+
+
+def test_lazy_sentry_scope_without_sentry_sdk(monkeypatch):
+    monkeypatch.setattr(aiohttp_request_id_logging, "sentry_sdk", None)
+    middleware = RequestIdMiddleware(lazy_sentry_scope=True)
+    response = run(middleware(make_mocked_request("GET", "/"), hello))
+    assert response.status == 200
+
+
+def test_add_request_id_to_sentry_event():
+    assert add_request_id_to_sentry_event({"message": "x"}, {}) == {"message": "x"}
+    token = request_id.set("abc1234")
+    try:
+        assert add_request_id_to_sentry_event({}, {}) == {"tags": {"request_id": "abc1234"}}
+        assert add_request_id_to_sentry_event({"tags": {"a": "b"}}, {}) == {"tags": {"a": "b", "request_id": "abc1234"}}
+        # a request_id tag set explicitly is kept
+        assert add_request_id_to_sentry_event({"tags": {"request_id": "other"}}, {}) == {"tags": {"request_id": "other"}}
+        assert add_request_id_to_sentry_breadcrumb({"message": "x"}, {}) == {"message": "x", "data": {"request_id": "abc1234"}}
+    finally:
+        request_id.reset(token)
+    assert add_request_id_to_sentry_breadcrumb({"message": "x"}, {}) == {"message": "x"}
+
+
+def test_lazy_sentry_scope_with_real_sentry_sdk():
+    sentry_sdk = pytest.importorskip("sentry_sdk")
+    events = []
+    # returning None from before_send drops the event - nothing is sent
+    sentry_sdk.init(dsn="https://public@sentry.example.com/1", before_send=lambda event, hint: events.append(event))
+    try:
+        middleware = RequestIdMiddleware(lazy_sentry_scope=True, request_id_factory=lambda: "abc1234")
+
+        async def capturing_handler(request):
+            sentry_sdk.capture_message("test message")
+            return web.Response(text="ok")
+
+        run(middleware(make_mocked_request("GET", "/"), capturing_handler))
+        sentry_sdk.flush()
+    finally:
+        sentry_sdk.init()
+    (event,) = events
+    assert event["tags"]["request_id"] == "abc1234"
+
+
+def test_sentry_make_scope_resolution_is_cached(monkeypatch):
+    lookups = []
+
+    class FakeSentry:
+        @property
+        def isolation_scope(self):
+            lookups.append(True)
+            return make_fake_scope_cm([])
+
+    monkeypatch.setattr(aiohttp_request_id_logging, "sentry_sdk", FakeSentry())
+    first = RequestIdMiddleware()
+    second = RequestIdMiddleware()
+    run(first(make_mocked_request("GET", "/"), hello))
+    run(second(make_mocked_request("GET", "/"), hello))
+    assert len(lookups) == 1
+
+
+def test_sentry_scope_can_be_switched_off_and_on_at_runtime(monkeypatch):
+    created_scopes = []
+    fake_sentry = SimpleNamespace(isolation_scope=make_fake_scope_cm(created_scopes))
+    monkeypatch.setattr(aiohttp_request_id_logging, "sentry_sdk", fake_sentry)
+    middleware = RequestIdMiddleware()
+    try:
+        set_sentry_scope_enabled(False)
+        assert middleware.sentry_make_scope is None
+        run(middleware(make_mocked_request("GET", "/"), hello))
+        assert created_scopes == []
+    finally:
+        set_sentry_scope_enabled(True)
+    assert middleware.sentry_make_scope is fake_sentry.isolation_scope
+    run(middleware(make_mocked_request("GET", "/"), hello))
+    assert len(created_scopes) == 1
+
+
+def test_overridden_resolve_sentry_make_scope_is_used(monkeypatch):
+    created_scopes = []
+    monkeypatch.setattr(aiohttp_request_id_logging, "sentry_sdk", None)
+
+    class CustomSentryMiddleware(RequestIdMiddleware):
+        @staticmethod
+        def resolve_sentry_make_scope():
+            return make_fake_scope_cm(created_scopes)
+
+    middleware = CustomSentryMiddleware()
+    run(middleware(make_mocked_request("GET", "/"), hello))
+    assert len(created_scopes) == 1
+
+
+def test_package_import_does_not_import_sentry_sdk():
+    # fresh interpreter - sentry_sdk may be imported in this one already
+    code = "\n".join(
+        [
+            "import sys",
+            "import aiohttp_request_id_logging",
+            "assert 'sentry_sdk' not in sys.modules",
+            "aiohttp_request_id_logging.RequestIdMiddleware()",
+            "assert aiohttp_request_id_logging.sentry_sdk is sys.modules.get('sentry_sdk')",
+        ]
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_unknown_package_attribute():
+    with pytest.raises(AttributeError, match="no_such_attribute"):
+        aiohttp_request_id_logging.no_such_attribute
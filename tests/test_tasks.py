@@ -0,0 +1,157 @@
+from asyncio import Task, all_tasks, create_task, gather, get_running_loop, run, sleep
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+from contextvars import Context
+
+from aiohttp_request_id_logging import (
+    RequestIdMiddleware,
+    child_request_id,
+    create_child_task,
+    get_task_request_id,
+    install_request_id_task_factory,
+    request_id,
+    with_child_request_id,
+)
+
+
+async def get_request_id_later():
+    await sleep(0)
+    return request_id.get()
+
+
+async def nested():
+    return [request_id.get(), await with_child_request_id(get_request_id_later()), await create_child_task(get_request_id_later())]
+
+
+def test_child_request_ids_in_handler():
+    seen = {}
+
+    async def handler(request):
+        seen["results"] = await gather(
+            with_child_request_id(get_request_id_later()),
+            create_child_task(get_request_id_later()),
+            with_child_request_id(nested()),
+        )
+        # the parent request id is not changed by the children
+        seen["after"] = request_id.get()
+        return web.Response(text="ok")
+
+    middleware = RequestIdMiddleware(request_id_factory=lambda: "abc1234")
+    response = run(middleware(make_mocked_request("GET", "/"), handler))
+    assert response.status == 200
+    assert seen["results"] == ["abc1234.1", "abc1234.2", ["abc1234.3", "abc1234.3.1", "abc1234.3.2"]]
+    assert seen["after"] == "abc1234"
+
+
+def test_child_request_id_numbering_restarts_for_a_new_request():
+    seen = []
+
+    async def handler(request):
+        seen.append(f"{child_request_id()} {child_request_id()}")
+        return web.Response(text="ok")
+
+    middleware = RequestIdMiddleware(request_id_factory=iter(["first", "second"]).__next__)
+
+    async def scenario():
+        # both requests run in the same task (and so in the same context)
+        await middleware(make_mocked_request("GET", "/"), handler)
+        await middleware(make_mocked_request("GET", "/"), handler)
+
+    run(scenario())
+    assert seen == ["first.1 first.2", "second.1 second.2"]
+
+
+def test_child_request_ids_are_shared_with_tasks_created_before_the_first_one():
+    seen = []
+
+    async def worker():
+        await sleep(0)
+        seen.append(child_request_id())
+        seen.append(await with_child_request_id(nested()))
+
+    async def handler(request):
+        # the task context is copied before any child id is taken
+        task = create_task(worker())
+        seen.append(child_request_id())
+        await task
+        seen.append(await create_child_task(nested()))
+        return web.Response(text="ok")
+
+    middleware = RequestIdMiddleware(request_id_factory=lambda: "abc")
+    run(middleware(make_mocked_request("GET", "/"), handler))
+    assert seen == [
+        "abc.1",
+        "abc.2",
+        ["abc.3", "abc.3.1", "abc.3.2"],
+        ["abc.4", "abc.4.1", "abc.4.2"],
+    ]
+
+
+def test_child_request_id_outside_of_request():
+    assert child_request_id() is None
+    assert run(with_child_request_id(get_request_id_later())) is None
+
+
+def test_task_factory_records_request_id():
+    async def handler(request):
+        task = create_task(sleep(0))
+        await task
+        assert get_task_request_id(task) == request_id.get()
+        return web.Response(text="ok")
+
+    async def scenario():
+        install_request_id_task_factory()
+        outside_task = create_task(sleep(0))
+        await outside_task
+        assert get_task_request_id(outside_task) is None
+        response = await RequestIdMiddleware(request_id_factory=lambda: "abc1234")(make_mocked_request("GET", "/"), handler)
+        assert response.status == 200
+        # usable for debug dumps of all tasks
+        assert {get_task_request_id(task) for task in all_tasks()} == {None}
+
+    run(scenario())
+
+
+def test_task_factory_falls_back_to_creating_task_request_id():
+    async def create_task_without_context():
+        task = Context().run(create_task, sleep(0))
+        await task
+        return task
+
+    async def handler(request):
+        task = await create_task(create_task_without_context())
+        assert get_task_request_id(task) == "abc1234"
+        return web.Response(text="ok")
+
+    async def scenario():
+        install_request_id_task_factory()
+        response = await RequestIdMiddleware(request_id_factory=lambda: "abc1234")(make_mocked_request("GET", "/"), handler)
+        assert response.status == 200
+        # the main task has no recorded request id
+        task = await create_task_without_context()
+        assert get_task_request_id(task) is None
+
+    run(scenario())
+
+
+def test_task_factory_keeps_previous_factory():
+    created = []
+
+    def previous_factory(loop, coro, **kwargs):
+        created.append(coro)
+        return Task(coro, loop=loop, **kwargs)
+
+    async def scenario():
+        get_running_loop().set_task_factory(previous_factory)
+        install_request_id_task_factory()
+        install_request_id_task_factory()  # the second call does nothing
+        token = request_id.set("abc1234")
+        try:
+            task = create_task(sleep(0))
+        finally:
+            request_id.reset(token)
+        await task
+        assert len(created) == 1
+        assert get_task_request_id(task) == "abc1234"
+
+    run(scenario())
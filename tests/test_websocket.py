@@ -0,0 +1,73 @@
+from aiohttp import WSMsgType, web
+from aiohttp.test_utils import TestClient, TestServer
+from asyncio import run
+from contextvars import copy_context
+from logging import INFO
+from pytest import raises
+
+from aiohttp_request_id_logging import RequestIdMiddleware, WebSocketMessageTracker, child_request_id, request_id
+
+
+def test_websocket_messages_get_derived_request_ids(caplog):
+    trackers = []
+
+    async def websocket_handler(request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        tracker = WebSocketMessageTracker()
+        trackers.append(tracker)
+        try:
+            async for msg in ws:
+                if msg.type == WSMsgType.TEXT:
+                    with tracker.message() as message_id:
+                        assert request_id.get() == message_id
+                        await ws.send_str(f"{request_id.get()}: {msg.data}")
+        finally:
+            tracker.log_summary()
+        return ws
+
+    async def scenario():
+        app = web.Application(middlewares=[RequestIdMiddleware(request_id_factory=lambda: "abc1234")])
+        app.router.add_get("/ws", websocket_handler)
+        async with TestClient(TestServer(app)) as client:
+            ws = await client.ws_connect("/ws")
+            replies = []
+            for text in ["hello", "world"]:
+                await ws.send_str(text)
+                replies.append(await ws.receive_str())
+            await ws.close()
+        return replies
+
+    with caplog.at_level(INFO, logger="aiohttp_request_id_logging"):
+        assert run(scenario()) == ["abc1234.m1: hello", "abc1234.m2: world"]
+    [tracker] = trackers
+    snapshot = tracker.snapshot()
+    assert snapshot["request_id"] == "abc1234"
+    assert snapshot["message_count"] == 2
+    assert snapshot["processing_time"] > 0
+    assert "WebSocket messages: 2, processing time" in caplog.text
+
+
+def test_websocket_message_tracker_outside_of_request():
+    with raises(ValueError):
+        WebSocketMessageTracker()
+    tracker = WebSocketMessageTracker("conn1")
+    with raises(ZeroDivisionError):
+        with tracker.message():
+            assert request_id.get() == "conn1.m1"
+            1 / 0
+    assert request_id.get() is None
+    assert tracker.message_count == 1
+
+
+def test_websocket_message_child_request_ids_do_not_share_the_connection_counter():
+    def scenario():
+        request_id.set("abc")
+        tracker = WebSocketMessageTracker()
+        ids = [child_request_id()]
+        with tracker.message():
+            ids.append(child_request_id())
+        ids.append(child_request_id())
+        return ids
+
+    assert copy_context().run(scenario) == ["abc.1", "abc.m1.1", "abc.2"]